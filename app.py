@@ -1,123 +1,675 @@
 import os
-import base64
 import json
 from io import BytesIO
 from fastapi import FastAPI, Request, HTTPException, Form, Query
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from starlette.middleware.sessions import SessionMiddleware
 from telethon import TelegramClient
+from telethon.utils import get_peer_id, get_display_name
 from telethon.tl.types import Chat, Channel, DocumentAttributeVideo, DocumentAttributeFilename, MessageMediaPhoto, \
     DocumentAttributeAudio, MessageMediaDocument
-from telethon.events import NewMessage
-from telethon.errors import SessionPasswordNeededError, ChatAdminRequiredError, FloodWaitError
-from telethon.tl.functions.channels import GetParticipantsRequest
-from telethon.tl.types import ChannelParticipantsSearch
+from telethon.events import NewMessage, MessageEdited, MessageDeleted, ChatAction, Raw
+from telethon.errors import SessionPasswordNeededError, ChatAdminRequiredError, FloodWaitError, RPCError
+from telethon.tl.types import InputMessagesFilterPhotoVideo, InputMessagesFilterDocument, InputMessagesFilterMusic, \
+    UpdateChannel, PeerChannel
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from collections import OrderedDict
+from urllib.parse import quote
+from types import SimpleNamespace
+from contextlib import asynccontextmanager, aclosing
+from bisect import bisect_right, insort
+from message_index import MessageIndex, is_channel_id
+from media_cache import MediaCache, media_key
+from live_feed import LiveFeed
+from download_scheduler import DownloadScheduler, PRIORITY_THUMBNAIL, PRIORITY_FULL, PRIORITY_PREFETCH
+from log_setup import setup_logging, LogSampler
+from metrics import REGISTRY, CONTENT_TYPE, Counter
+from thumbnails import PreviewRenderer, PREVIEW_MIME_TYPES
+from chat_export import ChatExport, ExportStore, RateBudget, iter_zip, STATUS_RUNNING, STATUS_WAITING, STATUS_DONE, \
+    STATUS_FAILED, STATUS_CANCELLED
+from rpc import RpcServer, RpcClient
+from telegram_rpc import TelegramService, RemoteTelegramClient
+from client_pool import ClientPool
 import mimetypes
 import asyncio
 import logging
-import hashlib
-import glob
 import time
 
-# Configure logging to file
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler("app.log"),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
+# Per-message logging in handle_message: sampled, and rate limited per chat (set up by configure())
+_message_log_sampler = None
+_message_log_text_max = 200
 
-# Load credentials from .env
-load_dotenv()
-API_ID = int(os.getenv("TG_API_ID"))
-API_HASH = os.getenv("TG_API_HASH")
-PHONE_NUMBER = os.getenv("TG_PHONE")
+# Prometheus metrics, served at /metrics
+_http_seconds = REGISTRY.histogram("http_request_duration_seconds",
+                                   "Time to produce a response (until headers for streamed bodies)",
+                                   ("method", "route", "status"))
+_helper_seconds = REGISTRY.histogram("helper_duration_seconds", "Time spent in data loading and rendering helpers",
+                                     ("helper",))
+_telegram_seconds = REGISTRY.histogram("telegram_request_duration_seconds",
+                                       "Telegram API request latency, including flood sleeps done by Telethon",
+                                       ("request", "outcome"))
+_flood_waits = REGISTRY.counter("telegram_flood_wait_total", "FloodWaitErrors raised by Telegram", ("request",))
+_flood_wait_seconds = REGISTRY.counter("telegram_flood_wait_seconds_total",
+                                       "Seconds of flood wait imposed by raised FloodWaitErrors", ("request",))
+# Lookups and evictions of the in-process caches; the media cache keeps its own counts (merged at scrape time)
+_cache_lookups = Counter("cache_requests_total", "", ("cache", "result"))
+_cache_evictions = Counter("cache_evictions_total", "", ("cache",))
+_streaming_downloads = 0  # Telegram downloads streamed straight to a response, in the scheduler's stream slots
 
-client = TelegramClient("web_session", API_ID, API_HASH)
-app = FastAPI()
+
+# Telegram client that times every API request by type and counts flood waits. Every request,
+# file downloads from other data centers included, goes through _call.
+class InstrumentedTelegramClient(TelegramClient):
+    async def _call(self, sender, request, ordered=False, flood_sleep_threshold=None):
+        name = type(request[0] if isinstance(request, list) and request else request).__name__
+        outcome = "error"
+        start = time.perf_counter()
+        try:
+            result = await super()._call(sender, request, ordered, flood_sleep_threshold)
+            outcome = "ok"
+            return result
+        except FloodWaitError as e:
+            outcome = "flood_wait"
+            _flood_waits.inc(request=name)
+            _flood_wait_seconds.inc(e.seconds, request=name)
+            raise
+        finally:
+            _telegram_seconds.observe(time.perf_counter() - start, request=name, outcome=outcome)
+
+    # Called by Telethon once a dropped connection is back; updates may have been lost meanwhile
+    async def _handle_auto_reconnect(self):
+        await super()._handle_auto_reconnect()
+        telegram_reconnected(self)
+
+
+# Credentials and settings, read from the environment and .env by configure() at startup
+API_ID = None
+API_HASH = None
+PHONE_NUMBER = None
+EXTRA_SESSIONS = []  # Further authorized sessions to spread requests and flood limits over (see client_pool.py)
+
+# Deployment role (TG_ROLE): "standalone" does everything in one process. To serve HTTP from several
+# processes, run one "owner", which holds the Telegram session, handles updates, runs the index sync
+# and exports, and serves Telegram calls over a Unix socket to any number of "worker" processes.
+_role = "standalone"
+_rpc_socket = "telegram.sock"
+_rpc_server = None
+_rpc_client = None
+
+# Telegram client, created by create_client() at startup; update handlers are collected by on_update
+client = None
+_update_handlers = []  # (handler, event builder)
+app = FastAPI(lifespan=lambda app: lifespan(app))
 app.add_middleware(SessionMiddleware, secret_key="your-secret-key")
 templates = Jinja2Templates(directory="templates")
-started = False
+
+# Startup progress: "starting", "connecting", "authorization_required" or "ready". Until the client
+# is ready, requests that need Telegram get a 503 (see reject_until_ready).
+_startup_status = "starting"
+_startup_error = None
+_startup_tasks = set()
+_cache_maintenance_interval = 3600
 
 # Cache for group chats and profile photos
-_groups_cache = None
-_profile_photo_cache = {}
+_groups_cache = None  # chat_id -> group, in dialog order
+_groups_fetched_at = 0.0
+_groups_ttl = 300
+_groups_refresh_task = None
+_rosters = {}  # chat_id -> {"members": {user_id: user info}, "ids": sorted user ids, "fetched_at": ...}
+_roster_tasks = {}
+_roster_ttl = 600
 _media_cache_dir = "media_cache"
-os.makedirs(_media_cache_dir, exist_ok=True)
+_media_cache = MediaCache(_media_cache_dir, budget_bytes=1024 * 1024 * 1024)
+_download_scheduler = DownloadScheduler(workers=4, streams=4)  # Shared by media, thumbnails and avatars
+_prefetch_tasks = set()
+# Profile photos: byte-bounded LRU in memory over a byte-bounded LRU of files on disk,
+# keyed by peer id and photo id so a changed avatar gets a new entry
+_avatar_cache_dir = os.path.join(_media_cache_dir, "avatars")
+_avatar_memory_cache = OrderedDict()  # "<peer_id>_<photo_id>" -> JPEG bytes
+_avatar_memory_bytes = 0
+_avatar_memory_budget = 4 * 1024 * 1024
+_avatar_cache = MediaCache(_avatar_cache_dir, budget_bytes=64 * 1024 * 1024)
+_media_chunk_size = 512 * 1024  # Telegram's maximum download request size
+_max_cached_media_size = 200 * 1024 * 1024  # Larger files are streamed without caching
+# Media tab selector -> Telegram-side search filter
+_media_filters = {
+    "photo_video": InputMessagesFilterPhotoVideo,
+    "document": InputMessagesFilterDocument,
+    "music": InputMessagesFilterMusic
+}
+_thumbnail_max_side = 320
+# Grid previews re-encoded from Telegram's thumbnails (needs Pillow; otherwise those are served as is)
+_preview_renderer = PreviewRenderer(max_side=_thumbnail_max_side)
+_media_message_cache = OrderedDict()  # (chat_id, message_id) -> message, for the /media endpoint
+_media_message_cache_size = 500
 _selected_chat_file = "selected_chat.json"
+_saved_chat_id = ...  # Last chat_id written to _selected_chat_file (Ellipsis until first load/save)
+_tabs = ("messages", "users", "media")
+_user_cache = OrderedDict()  # peer_id -> (expires_at, user info), shared by all tabs and handle_message
+_user_cache_ttl = 600
+_user_cache_size = 5000
+_message_scan_budget = 1000  # Most messages a single filtered page may scan
+
+# Local message index (SQLite/FTS5), kept up to date by the sync worker and handle_message
+_message_index = None  # MessageIndex of messages.db, opened by configure()
+_index_ready_chats = set()  # Chats caught up since startup, whose index can answer queries
+_index_sync_task = None
+_index_batch_size = 500
+_index_sync_pause = 1.0  # Seconds between sync requests while backfilling
+_index_resync_interval = 300
+
+# Live messages pushed to browsers over SSE; the ring buffers also answer "latest N" reads
+_live_feed = LiveFeed(buffer_size=200)
+_live_heartbeat = 15  # Seconds between SSE keep-alive comments
+
+# Chat exports: background jobs checkpointed under exports/, sharing one Telegram request budget
+_export_store = ExportStore("exports")
+_export_budget = None  # RateBudget of EXPORT_REQUESTS_PER_MINUTE, set up by configure()
+_export_tasks = {}  # chat_id -> running export task
+_export_batch_size = 100  # Messages per Telegram request
 
 
-# Save selected chat to file
+# Scrape-time views of state owned by the caches and the download scheduler
+def cache_request_counts() -> dict:
+    counts = _cache_lookups.snapshot()
+    counts[("media", "hit")] = _media_cache.hits
+    counts[("media", "miss")] = _media_cache.misses
+    counts[("avatar_disk", "hit")] = _avatar_cache.hits
+    counts[("avatar_disk", "miss")] = _avatar_cache.misses
+    return counts
+
+
+def cache_eviction_counts() -> dict:
+    counts = _cache_evictions.snapshot()
+    counts[("media",)] = _media_cache.evictions
+    counts[("avatar_disk",)] = _avatar_cache.evictions
+    return counts
+
+
+REGISTRY.callback("cache_requests_total", "Cache lookups by cache and result", "counter",
+                  cache_request_counts, ("cache", "result"))
+REGISTRY.callback("cache_evictions_total", "Entries evicted from each cache", "counter",
+                  cache_eviction_counts, ("cache",))
+REGISTRY.callback("cache_bytes", "Bytes held by each size-bounded cache", "gauge",
+                  lambda: {("media",): _media_cache.total_bytes, ("avatar_memory",): _avatar_memory_bytes,
+                           ("avatar_disk",): _avatar_cache.total_bytes}, ("cache",))
+REGISTRY.callback("cache_entries", "Entries held by each cache", "gauge",
+                  lambda: {("media",): len(_media_cache), ("avatar_memory",): len(_avatar_memory_cache),
+                           ("avatar_disk",): len(_avatar_cache),
+                           ("users",): len(_user_cache), ("media_messages",): len(_media_message_cache),
+                           ("groups",): len(_groups_cache or ()), ("rosters",): len(_rosters)}, ("cache",))
+REGISTRY.callback("downloads_in_flight", "Telegram downloads in progress", "gauge",
+                  lambda: {("scheduled",): _download_scheduler.inflight, ("streaming",): _streaming_downloads},
+                  ("kind",))
+REGISTRY.callback("downloads_queued", "Download jobs waiting for a scheduler worker", "gauge",
+                  lambda: _download_scheduler.queued)
+REGISTRY.callback("download_flood_pauses_total", "Flood waits that paused the download scheduler", "counter",
+                  lambda: _download_scheduler.flood_waits)
+REGISTRY.callback("download_flood_pause_seconds_total", "Seconds the download scheduler spent paused by flood waits",
+                  "counter", lambda: _download_scheduler.flood_seconds)
+REGISTRY.callback("live_subscribers", "Open server-sent event streams", "gauge",
+                  lambda: _live_feed.subscriber_count())
+REGISTRY.callback("telegram_account_requests_total", "Requests routed to each pooled account", "counter",
+                  lambda: {(account.name,): account.requests for account in pool_accounts()}, ("account",))
+REGISTRY.callback("telegram_account_flood_waits_total", "Flood waits hit by each pooled account", "counter",
+                  lambda: {(account.name,): account.flood_waits for account in pool_accounts()}, ("account",))
+REGISTRY.callback("telegram_account_cooldown_seconds", "Flood wait left for each pooled account", "gauge",
+                  lambda: {(account.name,): account.cooldown for account in pool_accounts()}, ("account",))
+REGISTRY.callback("telegram_account_failovers_total", "Calls moved to another account after a flood wait or "
+                  "access error", "counter", lambda: client.failovers if isinstance(client, ClientPool) else 0)
+REGISTRY.callback("exports_running", "Chat exports in progress", "gauge", lambda: len(_export_tasks))
+REGISTRY.callback("indexed_chats_ready", "Chats whose local message index is caught up", "gauge",
+                  lambda: len(_index_ready_chats))
+
+
+# Helper: Accounts of the client pool (none in worker processes, which have no Telegram client)
+def pool_accounts() -> list:
+    return client.accounts if isinstance(client, ClientPool) else []
+
+
+# Helper: Every pooled account is cooling down: pause downloads in worker processes too, as the
+# FloodWaitError only reaches the worker whose call hit it
+def pool_flood_wait(method: str, seconds: int):
+    if method in ("download_media", "download_profile_photo", "iter_download"):
+        notify_workers("flood_wait", seconds)
+
+
+# Save selected chat to file (only when it changes)
 def save_selected_chat(chat_id: int):
+    global _saved_chat_id
+    if chat_id == _saved_chat_id:
+        return
     try:
-        with open(_selected_chat_file, "w") as f:
+        # Written to a temp file and renamed, as several worker processes may save at once
+        tmp_file = f"{_selected_chat_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "w") as f:
             json.dump({"chat_id": chat_id}, f)
-        logger.info(f"Saved selected chat_id {chat_id} to {_selected_chat_file}")
+        os.replace(tmp_file, _selected_chat_file)
+        _saved_chat_id = chat_id
+        logger.info("Saved selected chat_id %s to %s", chat_id, _selected_chat_file)
     except Exception as e:
-        logger.error(f"Error saving selected chat: {e}")
+        logger.error("Error saving selected chat: %s", e)
 
 
 # Load selected chat from file
 def load_selected_chat() -> int | None:
+    global _saved_chat_id
     try:
         if os.path.exists(_selected_chat_file):
             with open(_selected_chat_file, "r") as f:
                 data = json.load(f)
                 chat_id = data.get("chat_id")
-                logger.info(f"Loaded selected chat_id {chat_id} from {_selected_chat_file}")
+                _saved_chat_id = chat_id
+                logger.info("Loaded selected chat_id %s from %s", chat_id, _selected_chat_file)
                 return chat_id
         return None
     except Exception as e:
-        logger.error(f"Error loading selected chat: {e}")
+        logger.error("Error loading selected chat: %s", e)
         return None
 
 
-async def get_group_chats():
-    global _groups_cache
-    if _groups_cache is not None:
-        logger.info("Returning cached group chats")
-        return _groups_cache
-    try:
+# Helper: Group list entry for a dialog's entity, or None for chats the UI doesn't list
+def group_entry(entity, name: str) -> dict | None:
+    if not isinstance(entity, (Channel, Chat)) or entity.creator or entity.left:
+        return None
+    username = getattr(entity, "username", None)
+    return {"id": get_peer_id(entity), "name": f"{name} (@{username})" if username else name,
+            "type": "channel" if isinstance(entity, Channel) else "group"}
+
+
+@_helper_seconds.timed(helper="refresh_group_chats")
+async def refresh_group_chats():
+    global _groups_cache, _groups_fetched_at
+    if _rpc_client is not None:
+        # The owner keeps the group list; workers copy it rather than each walking every dialog
+        logger.info("Fetching group chats from the owner process")
+        groups = {group["id"]: group for group in await on_owner(get_group_chats)}
+    else:
         logger.info("Fetching group chats from Telegram API")
-        groups = []
+        groups = {}
         async for dialog in client.iter_dialogs():
-            entity = dialog.entity
-            if isinstance(entity, (Channel, Chat)) and not entity.creator and not entity.left:
-                name = f"{dialog.name} (@{entity.username})" if entity.username else dialog.name
-                groups.append(
-                    {"id": dialog.id, "name": name, "type": "channel" if isinstance(entity, Channel) else "group"})
-        _groups_cache = groups
-        logger.info(f"Cached {len(groups)} group chats")
-        return groups
-    except Exception as e:
-        logger.error(f"Error fetching groups: {e}")
-        raise HTTPException(status_code=500, detail="Failed to fetch group chats")
+            group = group_entry(dialog.entity, dialog.name)
+            if group:
+                groups[group["id"]] = group
+    _groups_cache = groups
+    _groups_fetched_at = time.monotonic()
+    logger.info("Cached %s group chats", len(groups))
+    notify_workers("groups_stale")
+
+
+# Helper: Start a background group list refresh unless one is already running
+def schedule_groups_refresh() -> asyncio.Task:
+    global _groups_refresh_task
+    if _groups_refresh_task is None or _groups_refresh_task.done():
+        _groups_refresh_task = asyncio.create_task(refresh_group_chats())
+        _groups_refresh_task.add_done_callback(log_groups_refresh_error)
+    return _groups_refresh_task
+
+
+# Helper: 503 for a request Telegram is rate limiting, telling the client when to retry
+def rate_limit_error(e: FloodWaitError) -> HTTPException:
+    return HTTPException(status_code=503, detail="Telegram rate limit, retry later",
+                         headers={"Retry-After": str(e.seconds)})
+
+
+def log_groups_refresh_error(task: asyncio.Task):
+    if not task.cancelled() and task.exception():
+        logger.error("Error fetching groups: %s", task.exception())
 
 
-# Startup
-@app.on_event("startup")
-async def startup_event():
-    global started
+# Group list, stale-while-revalidate: past the TTL the cached list is returned at once while a
+# background refresh runs; only the very first call (before warm-up finishes) waits for Telegram
+@_helper_seconds.timed(helper="get_group_chats")
+async def get_group_chats() -> list[dict]:
+    if _groups_cache is None:
+        _cache_lookups.inc(cache="groups", result="miss")
+        try:
+            await asyncio.shield(schedule_groups_refresh())
+        except FloodWaitError as e:
+            raise rate_limit_error(e)
+        except Exception:
+            raise HTTPException(status_code=500, detail="Failed to fetch group chats")
+    elif time.monotonic() - _groups_fetched_at > _groups_ttl:
+        _cache_lookups.inc(cache="groups", result="stale")
+        logger.info("Group chats cache is stale, refreshing in the background")
+        schedule_groups_refresh()
+    else:
+        _cache_lookups.inc(cache="groups", result="hit")
+    return list(_groups_cache.values())
+
+
+def is_group_chat(chat_id: int) -> bool:
+    return _groups_cache is not None and chat_id in _groups_cache
+
+
+# Decorator: handle a Telegram update type. The client only exists once the app starts, so handlers
+# are collected here and added to it by create_client().
+def on_update(event):
+    def register(handler):
+        _update_handlers.append((handler, event))
+        return handler
+    return register
+
+
+# Keep the group list and member rosters current when we or others join or leave chats
+@on_update(ChatAction())
+async def handle_chat_action(event):
+    if not (event.user_joined or event.user_added or event.user_left or event.user_kicked):
+        return
+    left = event.user_left or event.user_kicked
+    if event.chat_id in _rosters or (_rpc_server is not None and _rpc_server.client_count):
+        left_ids = list(event.user_ids) if left else []
+        joined = [] if left else [cache_user(user) for user in await event.get_users() if user]
+        update_roster(event.chat_id, left_ids, joined)
+        notify_workers("roster", event.chat_id, left_ids, joined)
+    if _groups_cache is None or await client.get_peer_id("me") not in event.user_ids:
+        return
+    if left:
+        if _groups_cache.pop(event.chat_id, None):
+            logger.info("Left chat %s, removed from group list", event.chat_id)
+    else:
+        chat = await event.get_chat()
+        group = group_entry(chat, get_display_name(chat))
+        if group:
+            _groups_cache[group["id"]] = group
+            logger.info("Joined chat %s, added to group list", event.chat_id)
+    notify_workers("groups_stale")
+
+
+# Channel membership changes arrive as bare UpdateChannel, as do title, photo and admin changes:
+# look up just that channel and add, rename or remove its group list entry
+@on_update(Raw(UpdateChannel))
+async def handle_channel_update(update):
+    global _groups_fetched_at
+    if _groups_cache is None:
+        return
+    chat_id = get_peer_id(PeerChannel(update.channel_id))
     try:
-        if not started:
+        channel = await client.get_entity(PeerChannel(update.channel_id))
+        group = group_entry(channel, get_display_name(channel))
+    except FloodWaitError:
+        # Can't look the channel up now: let the next read revalidate the whole list
+        _groups_fetched_at = 0.0
+        notify_workers("groups_stale")
+        return
+    except (ValueError, RPCError) as e:
+        logger.debug("Channel %s is no longer accessible: %s", chat_id, e)
+        group = None
+    if group:
+        if _groups_cache.get(chat_id) == group:
+            return
+        _groups_cache[chat_id] = group
+        logger.info("Channel %s updated in group list", chat_id)
+    elif _groups_cache.pop(chat_id, None):
+        logger.info("Channel %s removed from group list", chat_id)
+    else:
+        return
+    notify_workers("groups_stale")
+
+
+# Helper: Tell worker processes about a change to state they cache (no-op unless this is the owner)
+def notify_workers(*event):
+    if _rpc_server is not None:
+        _rpc_server.broadcast(event)
+
+
+# Worker side of notify_workers: apply the owner's updates to this process's caches
+def handle_owner_event(event):
+    global _groups_fetched_at, _startup_status
+    kind, *args = event
+    if kind == "live":
+        _live_feed.publish(*args)
+    elif kind == "live_remove":
+        remove_live_messages(*args)
+    elif kind == "live_clear":
+        _live_feed.clear()
+    elif kind == "roster":
+        update_roster(*args)
+    elif kind == "groups_stale":
+        _groups_fetched_at = 0.0
+    elif kind == "index_ready":
+        _index_ready_chats.add(args[0])
+    elif kind == "flood_wait":
+        _download_scheduler.flood_wait(args[0])
+    elif kind == "status":
+        _startup_status = args[0]
+
+
+# After (re)connecting to the owner: events may have been missed meanwhile, so start over from its state
+async def sync_with_owner():
+    global _groups_fetched_at, _startup_status
+    _live_feed.clear()
+    _rosters.clear()
+    _groups_fetched_at = 0.0
+    try:
+        _startup_status = await _rpc_client.call("telegram_status")
+        _index_ready_chats.update(await _rpc_client.call("index_ready_chats"))
+        if _startup_status == "ready":
+            schedule_groups_refresh()
+    except Exception as e:
+        logger.error("Error syncing with the owner process: %s", e)
+
+
+# Helper: Run one of the owner's functions: here, or in the owner process when this is a worker
+async def on_owner(func, *args):
+    if _rpc_client is not None:
+        return await _rpc_client.call(func.__name__, *args)
+    return await func(*args)
+
+
+# Owner: serve Telegram and the owner-only functions to workers
+async def start_rpc_server():
+    TelegramService(client, _rpc_server)
+    for func in (sign_in, telegram_status, index_ready_chats, get_group_chats, get_roster, start_chat_export,
+                 list_chat_exports, chat_export_progress, cancel_chat_export):
+        _rpc_server.register(func.__name__, func)
+    await _rpc_server.start()
+
+
+async def index_ready_chats() -> list[int]:
+    return list(_index_ready_chats)
+
+
+async def telegram_status() -> str:
+    return _startup_status
+
+
+# Read settings from the environment and .env, set up logging and open the local stores. Runs when
+# the app starts, so importing the module has no side effects.
+def configure():
+    global API_ID, API_HASH, PHONE_NUMBER, EXTRA_SESSIONS, _role, _rpc_socket, _message_log_sampler, \
+        _message_index, _export_budget
+    load_dotenv()
+    setup_logging("app.log", level=getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO))
+    _message_log_sampler = LogSampler(sample_rate=float(os.getenv("LOG_MESSAGE_SAMPLE_RATE", "1.0")),
+                                      per_minute=float(os.getenv("LOG_MESSAGE_RATE_LIMIT", "30")))
+    _role = os.getenv("TG_ROLE", "standalone")
+    if _role not in ("standalone", "owner", "worker"):
+        raise RuntimeError(f"Unknown TG_ROLE {_role}")
+    _rpc_socket = os.getenv("TG_RPC_SOCKET", "telegram.sock")
+    if _role != "worker":
+        if not os.getenv("TG_API_ID") or not os.getenv("TG_API_HASH"):
+            raise RuntimeError("TG_API_ID and TG_API_HASH must be set")
+        API_ID = int(os.getenv("TG_API_ID"))
+        API_HASH = os.getenv("TG_API_HASH")
+    PHONE_NUMBER = os.getenv("TG_PHONE")
+    EXTRA_SESSIONS = [name.strip() for name in os.getenv("TG_EXTRA_SESSIONS", "").split(",") if name.strip()]
+    _preview_renderer.workers = int(os.getenv("PREVIEW_WORKERS", "2"))
+    _export_budget = RateBudget(per_minute=float(os.getenv("EXPORT_REQUESTS_PER_MINUTE", "60")))
+    _message_index = MessageIndex("messages.db")
+
+
+# The Telegram client for this process's role: the account pool, or a proxy to the owner process
+def create_client():
+    global client, _rpc_server, _rpc_client
+    if _role == "worker":
+        _rpc_client = RpcClient(_rpc_socket, on_event=handle_owner_event, on_connect=sync_with_owner)
+        client = RemoteTelegramClient(_rpc_client)
+        return
+    if _role == "owner":
+        _rpc_server = RpcServer(_rpc_socket)
+    # With several accounts Telethon must not sleep through flood waits: every FloodWaitError goes to
+    # the pool, which cools the account down and moves the call to another one. A single account
+    # keeps Telethon's default of sleeping through waits of up to a minute.
+    flood_sleep_threshold = 0 if EXTRA_SESSIONS else 60
+    client = ClientPool({name: InstrumentedTelegramClient(name, API_ID, API_HASH,
+                                                          flood_sleep_threshold=flood_sleep_threshold)
+                         for name in ["web_session", *EXTRA_SESSIONS]}, on_flood=pool_flood_wait)
+    for handler, event in _update_handlers:
+        client.add_event_handler(handler, event)
+
+
+def set_startup_status(status: str, error: str | None = None):
+    global _startup_status, _startup_error
+    _startup_status, _startup_error = status, error
+    notify_workers("status", status)
+
+
+# Helper: Whether requests that need Telegram can be served (in a worker: the owner is reachable and ready)
+def telegram_ready() -> bool:
+    if _rpc_client is not None and not _rpc_client.connected:
+        return False
+    return _startup_status == "ready"
+
+
+# Background startup: connect to Telegram, retrying with backoff, and check authorization. The
+# server accepts requests meanwhile; readiness is reported by /readyz.
+async def connect_telegram():
+    if _rpc_client is not None:
+        logger.info("Starting as a worker, Telegram calls go to %s", _rpc_socket)
+        await client.connect()  # Connects in the background, and reconnects, to the owner
+        return
+    await asyncio.to_thread(_export_store.load)
+    if _rpc_server is not None:
+        await start_rpc_server()
+    delay = 1
+    while True:
+        try:
+            set_startup_status("connecting", _startup_error)
             logger.info("Connecting to Telegram")
             await client.connect()
             if not await client.is_user_authorized():
                 logger.info("User not authorized, requesting code")
                 await client.send_code_request(PHONE_NUMBER)
-                raise HTTPException(status_code=307, detail="Redirect to /authorize")
-            clean_media_cache()  # Clean media cache on startup
-            started = True
-            logger.info("Telegram client initialized")
-    except Exception as e:
-        logger.error(f"Startup error: {e}")
-        raise HTTPException(status_code=500, detail="Failed to initialize Telegram client")
+                set_startup_status("authorization_required")
+                return  # sign_in() finishes startup
+            break
+        except Exception as e:
+            logger.error("Error connecting to Telegram, retrying in %s seconds: %s", delay, e)
+            set_startup_status("connecting", str(e))
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+    finish_startup()
+
+
+# Once authorized: warm the group list and start the background jobs
+def finish_startup():
+    schedule_groups_refresh()
+    set_startup_status("ready")
+    start_index_sync()
+    resume_exports()
+    logger.info("Telegram client initialized")
+
+
+# Background cache maintenance: enforce the cache budgets at startup and then periodically (only
+# one process needs to, as the cache index is shared)
+async def run_cache_maintenance():
+    while True:
+        try:
+            await clean_media_cache()
+        except Exception as e:
+            logger.error("Media cache maintenance error: %s", e)
+        await asyncio.sleep(_cache_maintenance_interval)
+
+
+def start_background(coroutine):
+    task = asyncio.create_task(coroutine)
+    _startup_tasks.add(task)
+    task.add_done_callback(_startup_tasks.discard)
+
+
+# Startup and shutdown. The server comes up at once: connecting and cache maintenance run in the
+# background, and requests that need Telegram get a fast 503 until the client is ready.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    configure()
+    create_client()
+    start_background(connect_telegram())
+    if _rpc_client is None:
+        start_background(run_cache_maintenance())
+    try:
+        yield
+    finally:
+        # Stop all background work before disconnecting, so nothing meets a closed connection.
+        # Cancelled exports keep their running status and resume at the next start.
+        tasks = [*_startup_tasks, *_export_tasks.values(), *_prefetch_tasks, *_roster_tasks.values(),
+                 *(task for task in (_index_sync_task, _groups_refresh_task) if task is not None)]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await _download_scheduler.stop()
+        if _rpc_server is not None:
+            await _rpc_server.stop()
+        await client.disconnect()
+        _media_cache.close()
+        _avatar_cache.close()
+        _message_index.close()
+        _preview_renderer.shutdown()
+
+
+# Liveness: the process is up and serving
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+
+# Readiness: 200 once requests can be served, 503 with the startup status until then
+@app.get("/readyz")
+async def readyz():
+    status = _startup_status
+    if _rpc_client is not None and not _rpc_client.connected:
+        status = "connecting"
+    body = {"status": status, "role": _role, "error": _startup_error}
+    return JSONResponse(body, status_code=200 if telegram_ready() else 503)
+
+
+# Fast 503 for anything needing Telegram before the client is ready, instead of requests hanging;
+# before authorization the UI goes to the login form
+_always_available = ("/healthz", "/readyz", "/metrics", "/authorize")
+
+
+@app.middleware("http")
+async def reject_until_ready(request: Request, call_next):
+    if telegram_ready() or request.url.path in _always_available:
+        return await call_next(request)
+    if _startup_status == "authorization_required" and request.url.path == "/":
+        return RedirectResponse(url="/authorize", status_code=303)
+    return JSONResponse({"detail": f"Telegram client is not ready ({_startup_status})"}, status_code=503,
+                        headers={"Retry-After": "5"})
+
+
+# Request timing by route template, so /media/{chat_id}/{message_id} is one series rather than one per file
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        _http_seconds.observe(time.perf_counter() - start, method=request.method,
+                              route=route.path if route else "unmatched", status=status)
+
+
+# Metrics endpoint in the Prometheus text format
+@app.get("/metrics")
+async def metrics():
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
 
 
 # Authorization endpoint
@@ -125,314 +677,1214 @@ async def startup_event():
 async def authorize(code: str = Form(...)):
     try:
         logger.info("Attempting to sign in with code")
-        await client.sign_in(PHONE_NUMBER, code)
+        await on_owner(sign_in, code)
         logger.info("Authorization successful")
+        schedule_groups_refresh()
         return RedirectResponse(url="/", status_code=303)
     except SessionPasswordNeededError:
         logger.error("2FA password required")
         raise HTTPException(status_code=400, detail="2FA password required")
     except Exception as e:
-        logger.error(f"Authorization failed: {e}")
+        logger.error("Authorization failed: %s", e)
         raise HTTPException(status_code=400, detail=f"Authorization failed: {e}")
 
 
+# Helper: Sign in and start the background jobs that need an authorized client
+async def sign_in(code: str):
+    await client.sign_in(PHONE_NUMBER, code)
+    finish_startup()
+
+
 @app.get("/authorize", response_class=HTMLResponse)
 async def authorize_form(request: Request):
     logger.info("Rendering authorization form")
-    return templates.TemplateResponse("authorize.html", {"request": request})
+    return templates.TemplateResponse(request, "authorize.html")
 
 
-# Helper: Clean media cache
-def clean_media_cache():
+# Helper: Load the media cache index and evict down to the size budget
+async def clean_media_cache():
     logger.info("Cleaning media cache")
-    for f in glob.glob(f"{_media_cache_dir}/*.bin"):
-        if os.path.getmtime(f) < time.time() - 7 * 86400:
-            os.remove(f)
-            logger.debug(f"Removed old cache file {f}")
-
-
-# Helper: Download profile photo with caching
-async def download_profile_photo(user_id: int, semaphore: asyncio.Semaphore):
-    global _profile_photo_cache
-    async with semaphore:
-        cache_key = f"user_{user_id}"
-        if cache_key in _profile_photo_cache:
-            logger.debug(f"Returning cached profile photo for user {user_id}")
-            return _profile_photo_cache[cache_key]
+    await _media_cache.load()
+    await _avatar_cache.load()
+
+
+# Helper: Keep an avatar in the in-memory LRU, evicting the least recently used past the byte budget
+def remember_avatar(key: str, data: bytes):
+    global _avatar_memory_bytes
+    if key in _avatar_memory_cache:
+        _avatar_memory_bytes -= len(_avatar_memory_cache.pop(key))
+    _avatar_memory_cache[key] = data
+    _avatar_memory_bytes += len(data)
+    while _avatar_memory_bytes > _avatar_memory_budget and len(_avatar_memory_cache) > 1:
+        _, evicted = _avatar_memory_cache.popitem(last=False)
+        _avatar_memory_bytes -= len(evicted)
+        _cache_evictions.inc(cache="avatar_memory")
+
+
+def read_cached_file(path: str) -> bytes | None:
+    try:
+        with open(path, "rb") as f:
+            return f.read() or None
+    except FileNotFoundError:
+        return None
+
+
+# Helper: Download profile photo with memory and disk caching
+@_helper_seconds.timed(helper="download_profile_photo")
+async def download_profile_photo(peer_id: int, photo_id: int) -> bytes | None:
+    key = f"{peer_id}_{photo_id}"
+    data = _avatar_memory_cache.get(key)
+    if data is not None:
+        _avatar_memory_cache.move_to_end(key)
+        _cache_lookups.inc(cache="avatar_memory", result="hit")
+        logger.debug("Returning cached profile photo for peer %s", peer_id)
+        return data
+    _cache_lookups.inc(cache="avatar_memory", result="miss")
+    path = await _avatar_cache.get(key)
+    data = await asyncio.to_thread(read_cached_file, path) if path else None
+    if data is None:
+        # Only the peer's current photo is downloaded, and only under its own id
+        if not await is_current_photo(peer_id, photo_id):
+            logger.debug("Photo %s is not the current profile photo of peer %s", photo_id, peer_id)
+            return None
         try:
-            await asyncio.sleep(0.1)  # Rate limiting
-            photo_file = await client.download_profile_photo(user_id, file=BytesIO())
-            if photo_file:
-                photo_data = f"data:image/jpeg;base64,{base64.b64encode(photo_file.getvalue()).decode('utf-8')}"
-                _profile_photo_cache[cache_key] = photo_data
-                logger.debug(f"Cached profile photo for user {user_id}")
-            else:
-                _profile_photo_cache[cache_key] = None
-                logger.debug(f"No profile photo for user {user_id}")
-            # Clean cache if too large
-            if len(_profile_photo_cache) > 1000:
-                logger.info("Clearing profile photo cache")
-                _profile_photo_cache.clear()
-            return _profile_photo_cache[cache_key]
+            photo_file = await _download_scheduler.submit(
+                ("avatar", key),
+                lambda: client.download_profile_photo(peer_id, file=BytesIO(), download_big=False),
+                PRIORITY_THUMBNAIL)
         except Exception as e:
-            logger.warning(f"Error downloading profile photo for user {user_id}: {e}")
-            _profile_photo_cache[cache_key] = None
+            logger.warning("Error downloading profile photo for peer %s: %s", peer_id, e)
+            return None
+        if not photo_file:
+            logger.debug("No profile photo for peer %s", peer_id)
             return None
+        data = photo_file.getvalue()
+        await _avatar_cache.put(key, data)
+        logger.debug("Cached profile photo for peer %s", peer_id)
+    remember_avatar(key, data)
+    return data
 
 
-# Helper: Download media with disk caching and retry on FloodWaitError
-async def download_media(message, thumbnail_only: bool = False, retries: int = 3):
-    media_type = message.media.__class__.__name__
-    media_id = f"{message.id}_{media_type}"
-    cache_file = os.path.join(_media_cache_dir, f"{hashlib.md5(media_id.encode()).hexdigest()}.bin")
+# Helper: Whether a photo is a peer's current profile photo, by the user cache or else one lookup
+async def is_current_photo(peer_id: int, photo_id: int) -> bool:
+    user_info = get_cached_user(peer_id)
+    if user_info is None:
+        try:
+            user_info = cache_user(await client.get_entity(peer_id))
+        except Exception as e:
+            logger.warning("Error looking up peer %s: %s", peer_id, e)
+            return False
+    return user_info["profile_photo"] == f"/avatar/{peer_id}/{photo_id}"
 
-    if os.path.exists(cache_file):
+
+# Helper: URL of a sender's current profile photo, or None when they have none
+def avatar_url(sender) -> str | None:
+    photo_id = getattr(getattr(sender, "photo", None), "photo_id", None)
+    if not photo_id:
+        return None
+    return f"/avatar/{get_peer_id(sender)}/{photo_id}"
+
+
+# Helper: Build the user info dict shown in every tab
+def build_user_info(sender) -> dict:
+    return {
+        "id": sender.id if sender else "Unknown",
+        "first_name": getattr(sender, "first_name", "Unknown"),
+        "last_name": getattr(sender, "last_name", ""),
+        "username": getattr(sender, "username", "No username"),
+        "phone": getattr(sender, "phone", "Hidden"),
+        "profile_photo": avatar_url(sender) if sender else None
+    }
+
+
+# Helper: Shared TTL/LRU cache of resolved senders, keyed by peer id
+def cache_user(sender) -> dict:
+    return cache_user_info(get_peer_id(sender), build_user_info(sender))
+
+
+def cache_user_info(peer_id: int, user_info: dict) -> dict:
+    _user_cache[peer_id] = (time.monotonic() + _user_cache_ttl, user_info)
+    _user_cache.move_to_end(peer_id)
+    while len(_user_cache) > _user_cache_size:
+        _user_cache.popitem(last=False)
+        _cache_evictions.inc(cache="users")
+    return user_info
+
+
+def get_cached_user(peer_id: int) -> dict | None:
+    entry = _user_cache.get(peer_id)
+    if entry is None:
+        _cache_lookups.inc(cache="users", result="miss")
+        return None
+    expires_at, user_info = entry
+    if expires_at < time.monotonic():
+        del _user_cache[peer_id]
+        _cache_lookups.inc(cache="users", result="expired")
+        return None
+    _user_cache.move_to_end(peer_id)
+    _cache_lookups.inc(cache="users", result="hit")
+    return user_info
+
+
+# Helper: Resolve the distinct senders of a page of messages, with one bulk request for cache misses
+@_helper_seconds.timed(helper="resolve_senders")
+async def resolve_senders(messages) -> dict:
+    senders = {}
+    missing = {}
+    for msg in messages:
+        sender_id = msg.sender_id
+        if sender_id is None or sender_id in senders or sender_id in missing:
+            continue
+        user_info = get_cached_user(sender_id)
+        sender = getattr(msg, "sender", None)
+        if user_info is None and sender is not None:
+            # iter_messages already returned the sender entity alongside the message
+            user_info = cache_user(sender)
+        if user_info is not None:
+            senders[sender_id] = user_info
+        else:
+            missing[sender_id] = getattr(msg, "input_sender", None) or sender_id
+    if missing:
         try:
-            with open(cache_file, "rb") as f:
-                media_bytes = BytesIO(f.read())
-            # Verify file integrity
-            if media_bytes.getbuffer().nbytes == 0:
-                logger.warning(f"Cached media {media_id} is empty, re-downloading")
-                os.remove(cache_file)
-            else:
-                logger.debug(f"Returning cached media {media_id}")
-                return media_bytes, media_type
+            logger.debug("Resolving %s senders in one request", len(missing))
+            for entity in await client.get_entity(list(missing.values())):
+                senders[get_peer_id(entity)] = cache_user(entity)
         except Exception as e:
-            logger.warning(f"Error reading cached media {media_id}: {e}")
-            os.remove(cache_file)
+            logger.warning("Error resolving senders %s: %s", list(missing), e)
+    return senders
 
-    for attempt in range(retries):
+
+# Helper: User info for each message on a page
+async def get_message_users(messages) -> list[dict]:
+    senders = await resolve_senders(messages)
+    return [senders.get(msg.sender_id) or build_user_info(None) for msg in messages]
+
+
+# Helper: Media cache key for a message's photo or document (the file itself, not the message)
+def media_cache_key(media, thumbnail_only: bool = False, variant: str | None = None) -> str | None:
+    if isinstance(media, MessageMediaPhoto) and media.photo:
+        kind, file = "photo", media.photo
+    elif isinstance(media, MessageMediaDocument) and media.document:
+        kind, file = "document", media.document
+    else:
+        return None
+    if variant is None:
+        variant = "full"
+        if thumbnail_only:
+            thumb = pick_thumbnail(media)
+            variant = f"thumb_{thumb.type}" if thumb else "thumb"
+    return media_key(kind, file.id, file.access_hash, variant)
+
+
+# Helper: Pick a grid-sized thumbnail for a photo or document
+def pick_thumbnail(media):
+    if isinstance(media, MessageMediaPhoto) and media.photo:
+        sizes = media.photo.sizes
+    elif isinstance(media, MessageMediaDocument) and media.document:
+        sizes = media.document.thumbs or []
+    else:
+        return None
+    sizes = [s for s in sizes if getattr(s, "w", None) and getattr(s, "h", None)]
+    if not sizes:
+        return None
+    fitting = [s for s in sizes if max(s.w, s.h) <= _thumbnail_max_side]
+    if fitting:
+        return max(fitting, key=lambda s: s.w * s.h)
+    return min(sizes, key=lambda s: s.w * s.h)
+
+
+# Helper: Describe message media (kind, filename, mime type and size when known)
+def describe_media(media) -> dict:
+    if isinstance(media, MessageMediaPhoto) and media.photo:
+        return {"type": "image", "filename": None, "mime_type": "image/jpeg", "size": None}
+    if isinstance(media, MessageMediaDocument) and media.document:
+        document = media.document
+        is_video = any(isinstance(attr, DocumentAttributeVideo) for attr in document.attributes)
+        is_audio = any(isinstance(attr, DocumentAttributeAudio) for attr in document.attributes)
+        filename = next((attr.file_name for attr in document.attributes if
+                         isinstance(attr, DocumentAttributeFilename)), "document")
+        mime_type = document.mime_type or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        if is_video:
+            return {"type": "video", "filename": None, "mime_type": mime_type, "size": document.size}
+        if is_audio:
+            return {"type": "audio", "filename": filename, "mime_type": mime_type, "size": document.size}
+        return {"type": "document", "filename": filename, "mime_type": mime_type, "size": document.size}
+    return {"type": "unsupported", "filename": None, "mime_type": None, "size": None}
+
+
+# Helper: Remember messages listed on a media page so /media can serve them without a lookup
+def remember_media_message(message):
+    key = (message.chat_id, message.id)
+    _media_message_cache[key] = message
+    _media_message_cache.move_to_end(key)
+    while len(_media_message_cache) > _media_message_cache_size:
+        _media_message_cache.popitem(last=False)
+        _cache_evictions.inc(cache="media_messages")
+
+
+async def get_media_message(chat_id: int, message_id: int):
+    message = _media_message_cache.get((chat_id, message_id))
+    _cache_lookups.inc(cache="media_messages", result="miss" if message is None else "hit")
+    if message is None:
         try:
-            media_bytes = await client.download_media(message.media, file=BytesIO(), thumb=thumbnail_only)
-            if media_bytes.getbuffer().nbytes > 10 * 1024 * 1024:  # Limit to 10 MB
-                logger.warning(f"Media {media_id} too large, skipping")
-                raise ValueError("Media too large")
-            with open(cache_file, "wb") as f:
-                f.write(media_bytes.getvalue())
-            logger.debug(f"Cached media {media_id} to disk")
-            return media_bytes, media_type
+            message = await client.get_messages(chat_id, ids=message_id)
         except FloodWaitError as e:
-            logger.warning(f"FloodWaitError for media {media_id}, waiting {e.seconds} seconds")
-            await asyncio.sleep(e.seconds)
+            raise rate_limit_error(e)
+        except (ValueError, RPCError) as e:
+            logger.warning("Error looking up message %s in chat %s: %s", message_id, chat_id, e)
+            raise HTTPException(status_code=404, detail="Media not found")
+        if message is not None and message.media:
+            remember_media_message(message)
+    return message
+
+
+# Helper: Write a document to the media cache in chunks, never holding the whole file in memory.
+# Responses for the same file follow the cache fill while it is written (see iter_cache_fill).
+async def fetch_document(message, cache_key: str) -> str:
+    size = message.media.document.size
+    fill = _media_cache.begin_fill(cache_key)
+    try:
+        async for chunk in client.iter_download(message.media, request_size=_media_chunk_size, file_size=size):
+            await fill.write(chunk)
+    except BaseException as e:
+        await fill.discard(e)
+        raise
+    return await fill.commit()
+
+
+# Helper: Fetch media from Telegram into the media cache, retrying errors other than FloodWaitError
+# (the download scheduler requeues those behind its global flood wait)
+@_helper_seconds.timed(helper="fetch_media")
+async def fetch_media(message, thumbnail_only: bool, cache_key: str, retries: int = 3) -> str:
+    media_id = f"{message.chat_id}_{message.id}_{'thumb' if thumbnail_only else 'full'}"
+    size = describe_media(message.media)["size"]
+    if not thumbnail_only and size is not None and size > _max_cached_media_size:
+        logger.warning("Media %s too large (%s bytes), skipping", media_id, size)
+        raise ValueError("Media too large")
+    thumb = pick_thumbnail(message.media) if thumbnail_only else None
+    for attempt in range(retries):
+        try:
+            if size is not None and not thumbnail_only:
+                cache_file = await fetch_document(message, cache_key)
+            else:
+                # Photos and thumbnails are small enough to buffer
+                media_bytes = await client.download_media(message.media, file=BytesIO(), thumb=thumb)
+                cache_file = await _media_cache.put(cache_key, media_bytes.getvalue())
+            logger.debug("Cached media %s to disk", media_id)
+            return cache_file
+        except FloodWaitError:
+            raise
         except Exception as e:
-            logger.warning(f"Error downloading media {media_id} (attempt {attempt + 1}/{retries}): {e}")
+            logger.warning("Error downloading media %s (attempt %s/%s): %s", media_id, attempt + 1, retries, e)
             if attempt == retries - 1:
                 raise
             await asyncio.sleep(1)
 
 
-# Helper: List last messages from group chats with filters and detailed user info
+# Helper: Download media into the media cache through the shared scheduler; returns the cached file
+@_helper_seconds.timed(helper="download_media")
+async def download_media(message, thumbnail_only: bool = False, priority: int | None = None) -> str:
+    cache_key = media_cache_key(message.media, thumbnail_only)
+    cache_file = await _media_cache.get(cache_key)
+    if cache_file:
+        logger.debug("Returning cached media %s_%s", message.chat_id, message.id)
+        return cache_file
+    if priority is None:
+        priority = PRIORITY_THUMBNAIL if thumbnail_only else PRIORITY_FULL
+    return await _download_scheduler.submit(cache_key, lambda: fetch_media(message, thumbnail_only, cache_key),
+                                            priority)
+
+
+# Helper: Grid preview of a message's photo or document, rendered once from Telegram's thumbnail and
+# kept in the media cache; returns the cached file
+@_helper_seconds.timed(helper="get_preview")
+async def get_preview(message, fmt: str, priority: int = PRIORITY_THUMBNAIL) -> str:
+    cache_key = media_cache_key(message.media, variant=f"preview_{_preview_renderer.max_side}.{fmt}")
+    cache_file = await _media_cache.get(cache_key)
+    if cache_file:
+        return cache_file
+    source_file = await download_media(message, thumbnail_only=True, priority=priority)
+    cache_file = await _media_cache.get(cache_key)  # Another request may have rendered it meanwhile
+    if cache_file:
+        return cache_file
+    return await _media_cache.put(cache_key, await _preview_renderer.render(cache_key, source_file, fmt))
+
+
+# Helper: Warm the cache with a page's thumbnails (or previews) before the browser asks for them
+def prefetch_thumbnails(messages):
+    async def prefetch(message):
+        try:
+            if _preview_renderer.available:
+                await get_preview(message, _preview_renderer.formats[0], priority=PRIORITY_PREFETCH)
+            else:
+                await download_media(message, thumbnail_only=True, priority=PRIORITY_PREFETCH)
+        except Exception as e:
+            logger.debug("Error prefetching thumbnail for message %s: %s", message.id, e)
+
+    for message in messages:
+        if pick_thumbnail(message.media) is not None:
+            task = asyncio.create_task(prefetch(message))
+            _prefetch_tasks.add(task)
+            task.add_done_callback(_prefetch_tasks.discard)
+
+
+# Helper: Parse a single "bytes=" Range header into an inclusive (start, end) pair
+def parse_range_header(range_header: str | None, size: int):
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start_str, _, end_str = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if start_str:
+            start = int(start_str)
+            end = int(end_str) if end_str else size - 1
+        else:
+            start = max(size - int(end_str), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    end = min(end, size - 1)
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, detail="Requested range not satisfiable",
+                            headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+# Helper: Read a byte range of an open cached file in chunks (iterated in Starlette's threadpool).
+# Taking an open file keeps the response intact if the cache evicts the file meanwhile.
+def iter_file_range(f, start: int, end: int):
+    with f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(_media_chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+# Helper: Stream a byte range of a document that fits the media cache. The whole file is fetched into
+# the cache through the download scheduler, so viewers of the same file share one bounded download,
+# and the response follows the cache fill as it is written (each retry of the fetch is a new fill).
+async def iter_cache_fill(message, cache_key: str, start: int, end: int):
+    fetch = asyncio.ensure_future(download_media(message))
+    position = start
+    try:
+        while position <= end:
+            fill = _media_cache.filling(cache_key)
+            if fill is None:
+                if fetch.done():
+                    break
+                waiter = asyncio.ensure_future(_media_cache.wait_for_fill())
+                await asyncio.wait([fetch, waiter], return_when=asyncio.FIRST_COMPLETED)
+                waiter.cancel()
+                continue
+            try:
+                async for chunk in fill.follow(position, end, _media_chunk_size):
+                    position += len(chunk)
+                    yield chunk
+                break
+            except Exception as e:
+                logger.debug("Cache fill of media %s stopped (%s), waiting for the download", message.id, e)
+        if position <= end:
+            # Already cached, or cached between checks: read the rest from the file
+            chunks = iter_file_range(await asyncio.to_thread(open, await fetch, "rb"), position, end)
+            while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+                yield chunk
+    finally:
+        if not fetch.done():
+            fetch.cancel()  # Only stops waiting; the download itself finishes in the scheduler
+        elif not fetch.cancelled():
+            fetch.exception()
+
+
+# Helper: Stream a byte range of a document straight from Telegram, for files too large to cache and
+# ranges past what is cached; each stream holds one of the download scheduler's stream slots
+async def iter_telegram_range(message, start: int, end: int, size: int):
+    global _streaming_downloads
+    # Telegram only serves parts at offsets aligned to the request size: start at the part holding
+    # `start` and drop the bytes before it
+    offset = start - start % _media_chunk_size
+    skip = start - offset
+    remaining = end - start + 1
+    async with _download_scheduler.stream_slot():
+        _streaming_downloads += 1
+        try:
+            async with aclosing(client.iter_download(message.media, offset=offset, request_size=_media_chunk_size,
+                                                     file_size=size)) as chunks:
+                async for chunk in chunks:
+                    if skip:
+                        dropped = min(skip, len(chunk))
+                        chunk, skip = chunk[dropped:], skip - dropped
+                        if not chunk:
+                            continue
+                    chunk = chunk[:remaining]
+                    remaining -= len(chunk)
+                    yield chunk
+                    if remaining <= 0:
+                        break
+        except FloodWaitError as e:
+            _download_scheduler.flood_wait(e.seconds)
+            raise
+        finally:
+            _streaming_downloads -= 1
+
+
+# Helper: Row for the local message index
+def index_record(msg) -> dict:
+    return {
+        "id": msg.id,
+        "date": msg.date,
+        "sender_id": msg.sender_id,
+        "text": msg.text or "",
+        "media_type": msg.media.__class__.__name__ if msg.media else None
+    }
+
+
+# Helper: Write a batch of Telegram messages to the local index
+async def index_messages(chat_id: int, messages):
+    records = [index_record(msg) for msg in messages if msg.text or msg.media]
+    if records:
+        await asyncio.to_thread(_message_index.add_messages, chat_id, records)
+
+
+# Helper: One sync step for a chat: catch up on everything newer than the watermark, then backfill
+# one batch of older history. Returns True once the chat's whole history is indexed.
+@_helper_seconds.timed(helper="sync_chat_index")
+async def sync_chat_index(chat_id: int) -> bool:
+    state = await asyncio.to_thread(_message_index.get_state, chat_id)
+    if state is None:
+        batch = [msg async for msg in client.iter_messages(chat_id, limit=_index_batch_size)]
+        await index_messages(chat_id, batch)
+        newest_id, oldest_id = (batch[0].id, batch[-1].id) if batch else (0, 0)
+        done = len(batch) < _index_batch_size
+        await asyncio.to_thread(_message_index.update_state, chat_id, newest_id, oldest_id, done)
+        mark_index_ready(chat_id)
+        logger.info("Indexed first %s messages of chat %s", len(batch), chat_id)
+        return done
+
+    # The watermark only moves once catch-up completes, so an interrupted catch-up leaves no gap
+    batch = []
+    newest_id = state["newest_id"]
+    async for msg in client.iter_messages(chat_id, min_id=state["newest_id"], limit=None):
+        newest_id = max(newest_id, msg.id)
+        batch.append(msg)
+        if len(batch) >= _index_batch_size:
+            await index_messages(chat_id, batch)
+            batch = []
+    await index_messages(chat_id, batch)
+    await asyncio.to_thread(_message_index.update_state, chat_id, newest_id)
+    mark_index_ready(chat_id)
+
+    if state["backfill_done"]:
+        return True
+    batch = [msg async for msg in client.iter_messages(chat_id, offset_id=state["oldest_id"], limit=_index_batch_size)]
+    await index_messages(chat_id, batch)
+    done = len(batch) < _index_batch_size
+    await asyncio.to_thread(_message_index.update_state, chat_id, None, batch[-1].id if batch else None, done)
+    logger.info("Backfilled %s messages of chat %s, complete: %s", len(batch), chat_id, done)
+    return done
+
+
+def mark_index_ready(chat_id: int):
+    if chat_id not in _index_ready_chats:
+        _index_ready_chats.add(chat_id)
+        notify_workers("index_ready", chat_id)
+
+
+# Background worker: round-robin over all groups until their history is indexed, then re-sync periodically
+async def run_index_sync():
+    while True:
+        pending = False
+        try:
+            for group in await get_group_chats():
+                try:
+                    pending = not await sync_chat_index(group["id"]) or pending
+                except FloodWaitError:
+                    raise
+                except Exception as e:
+                    logger.warning("Error indexing chat %s: %s", group['id'], e)
+                await asyncio.sleep(_index_sync_pause)
+        except FloodWaitError as e:
+            logger.warning("FloodWaitError in index sync, waiting %s seconds", e.seconds)
+            await asyncio.sleep(e.seconds)
+            pending = True
+        except Exception as e:
+            logger.error("Index sync error: %s", e)
+        await asyncio.sleep(_index_sync_pause if pending else _index_resync_interval)
+
+
+def start_index_sync():
+    global _index_sync_task
+    if _rpc_client is not None:
+        return  # The owner process syncs the index
+    if _index_sync_task is None or _index_sync_task.done():
+        _index_sync_task = asyncio.create_task(run_index_sync())
+        logger.info("Started message index sync")
+
+
+# Helper: Answer a messages page from the local index, or None when the index can't answer it
+@_helper_seconds.timed(helper="search_message_index")
+async def search_message_index(chat_id: int, limit: int, offset_id: int, query: str | None,
+                               start: datetime | None, end: datetime | None):
+    if chat_id not in _index_ready_chats:
+        return None
+    state = await asyncio.to_thread(_message_index.get_state, chat_id)
+    rows = await asyncio.to_thread(_message_index.search, chat_id, limit, offset_id, query, start, end)
+    # The indexed range is contiguous up to the newest message, so a full page is exact;
+    # a short page is only exact once the backfill has reached the start of the chat
+    if len(rows) < limit and not state["backfill_done"]:
+        return None
+    return [SimpleNamespace(**row) for row in rows], state["synced_at"]
+
+
+# Helper: Parse a YYYY-MM-DD filter value
+def parse_filter_date(value: str | None):
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid date: {value}")
+
+
+# Helper: List last messages from group chats with filters and detailed user info.
+# Text search and the end date are pushed down to Telegram (search=/offset_date=); since results
+# come newest first, scanning stops at the start date, once `limit` matches are found, or when
+# the scan budget runs out.
+@_helper_seconds.timed(helper="get_last_messages")
 async def get_last_messages(chat_id: int, limit: int = 10, offset_id: int = 0, query: str = None,
                             start_date: str = None, end_date: str = None):
+    start = parse_filter_date(start_date)
+    end = parse_filter_date(end_date)
+    offset_date = datetime(end.year, end.month, end.day, tzinfo=timezone.utc) + timedelta(days=1) if end else None
     try:
-        logger.info(f"Fetching messages for chat {chat_id} with limit {limit}, offset {offset_id}")
-        messages = []
-        semaphore = asyncio.Semaphore(3)  # Reduced to 3 for safety
-        async for msg in client.iter_messages(chat_id, limit=limit, offset_id=offset_id):
-            if msg.text or msg.media:
-                if query and query.lower() not in (msg.text or "").lower():
-                    continue
-                if start_date or end_date:
-                    msg_date = msg.date.date()
-                    start = datetime.strptime(start_date, "%Y-%m-%d").date() if start_date else None
-                    end = datetime.strptime(end_date, "%Y-%m-%d").date() if end_date else None
-                    if start and msg_date < start:
-                        continue
-                    if end and msg_date > end:
-                        continue
-                sender = await msg.get_sender()
-                profile_photo = None
-                if sender and hasattr(sender, 'id'):
-                    profile_photo = await download_profile_photo(sender.id, semaphore)
-                user_info = {
-                    "id": sender.id if sender else "Unknown",
-                    "first_name": getattr(sender, "first_name", "Unknown"),
-                    "last_name": getattr(sender, "last_name", ""),
-                    "username": getattr(sender, "username", "No username"),
-                    "phone": getattr(sender, "phone", "Hidden"),
-                    "profile_photo": profile_photo
-                }
-                content = msg.text if msg.text else f"[Media: {msg.media.__class__.__name__}]"
+        if not (offset_id or query or start or end):
+            buffered = _live_feed.latest(chat_id, limit)
+            if buffered is not None:
+                logger.info("Fetched %s messages for chat %s from the live buffer", len(buffered), chat_id)
+                return {"messages": buffered, "next_offset_id": buffered[-1]["id"], "synced_at": None}
+        indexed = await search_message_index(chat_id, limit, offset_id, query,
+                                             datetime(start.year, start.month, start.day,
+                                                      tzinfo=timezone.utc) if start else None,
+                                             offset_date)
+        if indexed is not None:
+            page, synced_at = indexed
+            messages = []
+            for msg, user_info in zip(page, await get_message_users(page)):
+                content = msg.text if msg.text else f"[Media: {msg.media_type}]"
                 messages.append({"content": content, "date": msg.date, "id": msg.id, "user": user_info})
+            next_offset_id = messages[-1]["id"] if messages else offset_id
+            logger.info("Fetched %s messages for chat %s from the local index", len(messages), chat_id)
+            return {"messages": messages, "next_offset_id": next_offset_id,
+                    "synced_at": datetime.fromtimestamp(synced_at, tz=timezone.utc)}
+
+        logger.info("Fetching messages for chat %s with limit %s, offset %s", chat_id, limit, offset_id)
+        page = []
+        messages_scanned = 0
+        scan_limit = max(limit, _message_scan_budget) if query or start or end else limit
+        async for msg in client.iter_messages(chat_id, limit=scan_limit, offset_id=offset_id,
+                                              offset_date=offset_date, search=query or None):
+            messages_scanned += 1
+            if start and msg.date.date() < start:
+                break
+            if msg.text or msg.media:
+                page.append(msg)
+                if len(page) >= limit:
+                    break
+        logger.debug("Scanned %s messages for chat %s", messages_scanned, chat_id)
+        messages = []
+        for msg, user_info in zip(page, await get_message_users(page)):
+            content = msg.text if msg.text else f"[Media: {msg.media.__class__.__name__}]"
+            messages.append({"content": content, "date": msg.date, "id": msg.id, "user": user_info})
         next_offset_id = messages[-1]["id"] if messages else offset_id
-        logger.info(f"Fetched {len(messages)} messages for chat {chat_id}")
-        return {"messages": messages, "next_offset_id": next_offset_id}
+        logger.info("Fetched %s messages for chat %s", len(messages), chat_id)
+        return {"messages": messages, "next_offset_id": next_offset_id, "synced_at": None}
+    except FloodWaitError as e:
+        logger.warning("FloodWaitError fetching messages for chat %s, retry in %s seconds", chat_id, e.seconds)
+        raise rate_limit_error(e)
     except Exception as e:
-        logger.error(f"Error fetching messages for chat {chat_id}: {e}")
+        logger.error("Error fetching messages for chat %s: %s", chat_id, e)
         raise HTTPException(status_code=500, detail="Failed to fetch messages")
 
 
-# Helper: List all users in a chat with proper pagination
-async def get_chat_users(chat_id: int, limit: int = 100, offset: int = 0):
+# Helper: Fetch a chat's member roster in one bulk pass, kept sorted by user id so paging can
+# resume after any id (a stable cursor, unaffected by members joining or leaving meanwhile).
+# Telegram lists only part of a large channel's members, so the member count comes separately.
+@_helper_seconds.timed(helper="load_roster")
+async def load_roster(chat_id: int) -> dict:
+    if _rpc_client is not None:
+        # The owner holds the rosters and keeps them current; workers copy them, along with the
+        # owner's fetch time (time.monotonic() is the same clock in every process on the host)
+        logger.info("Fetching member roster for chat %s from the owner process", chat_id)
+        roster = await on_owner(get_roster, chat_id)
+        for user_id, user_info in roster["members"].items():
+            cache_user_info(user_id, user_info)
+    else:
+        logger.info("Fetching member roster for chat %s", chat_id)
+        count = (await client.get_participants(chat_id, limit=0)).total
+        members = {}
+        async for user in client.iter_participants(chat_id):
+            members[user.id] = cache_user(user)
+        roster = {"members": members, "ids": sorted(members), "count": max(count or 0, len(members)),
+                  "fetched_at": time.monotonic()}
+    _rosters[chat_id] = roster
+    logger.info("Cached %s of %s members for chat %s", len(roster["ids"]), roster["count"], chat_id)
+    return roster
+
+
+# Member roster, stale-while-revalidate like the group list; concurrent loads of one chat share a task
+async def get_roster(chat_id: int) -> dict:
+    roster = _rosters.get(chat_id)
+    task = _roster_tasks.get(chat_id)
+    if roster is not None and time.monotonic() - roster["fetched_at"] <= _roster_ttl:
+        _cache_lookups.inc(cache="rosters", result="hit")
+        return roster
+    _cache_lookups.inc(cache="rosters", result="miss" if roster is None else "stale")
+    if task is None or task.done():
+        task = asyncio.create_task(load_roster(chat_id))
+        task.add_done_callback(lambda t: finish_roster_load(chat_id, t))
+        _roster_tasks[chat_id] = task
+    if roster is not None:
+        return roster
+    return await asyncio.shield(task)
+
+
+def finish_roster_load(chat_id: int, task: asyncio.Task):
+    _roster_tasks.pop(chat_id, None)
+    if not task.cancelled() and task.exception():
+        logger.warning("Error fetching member roster for chat %s: %s", chat_id, task.exception())
+
+
+# Helper: Apply a join/leave event (ids that left, user info of those who joined) to a cached roster
+def update_roster(chat_id: int, left_ids: list[int], joined: list[dict]):
+    roster = _rosters.get(chat_id)
+    if roster is None:
+        return
+    for user_id in left_ids:
+        roster["count"] -= 1
+        if roster["members"].pop(user_id, None):
+            roster["ids"].remove(user_id)
+    for user_info in joined:
+        if user_info["id"] not in roster["members"]:
+            roster["count"] += 1
+            insort(roster["ids"], user_info["id"])
+        roster["members"][user_info["id"]] = user_info
+    logger.debug("Updated roster for chat %s, %s members", chat_id, len(roster['ids']))
+
+
+# Helper: List users in a chat from its cached roster, paging after the last user id shown
+@_helper_seconds.timed(helper="get_chat_users")
+async def get_chat_users(chat_id: int, limit: int = 100, offset: int = 0, query: str = None):
     try:
-        logger.info(f"Fetching users for chat {chat_id} with limit {limit}, offset {offset}")
+        logger.info("Fetching users for chat %s with limit %s, after user %s", chat_id, limit, offset)
+        roster = await get_roster(chat_id)
+        ids = roster["ids"]
+        needle = query.lower() if query else None
         users = []
-        semaphore = asyncio.Semaphore(3)  # Reduced to 3 for safety
-        entity = await client.get_entity(chat_id)
-        logger.debug(f"Entity type: {type(entity).__name__}")
-        if isinstance(entity, Channel):
-            participants = await client(GetParticipantsRequest(
-                channel=entity,
-                filter=ChannelParticipantsSearch(''),
-                offset=offset,
-                limit=limit + 1,
-                hash=0
-            ))
-            logger.debug(f"Fetched {len(participants.users)} participants")
-            photo_tasks = [download_profile_photo(user.id, semaphore) for user in participants.users[:limit]]
-            profile_photos = await asyncio.gather(*photo_tasks, return_exceptions=True)
-            for user, profile_photo in zip(participants.users[:limit], profile_photos):
-                user_info = {
-                    "id": user.id,
-                    "first_name": getattr(user, "first_name", "Unknown"),
-                    "last_name": getattr(user, "last_name", ""),
-                    "username": getattr(user, "username", "No username"),
-                    "phone": getattr(user, "phone", "Hidden"),
-                    "profile_photo": profile_photo if isinstance(profile_photo, str) else None
-                }
-                users.append(user_info)
-            has_next = len(participants.users) > limit
-            next_offset_id = offset + len(users) if has_next else None
-            logger.info(f"Fetched {len(users)} users for channel {chat_id}, has_next: {has_next}")
-        else:
-            count = 0
-            async for user in client.iter_participants(chat_id, limit=limit + 1):
-                if offset > 0:
-                    offset -= 1
-                    continue
-                if count >= limit:
-                    break
-                profile_photo = await download_profile_photo(user.id, semaphore)
-                user_info = {
-                    "id": user.id,
-                    "first_name": getattr(user, "first_name", "Unknown"),
-                    "last_name": getattr(user, "last_name", ""),
-                    "username": getattr(user, "username", "No username"),
-                    "phone": getattr(user, "phone", "Hidden"),
-                    "profile_photo": profile_photo
-                }
-                users.append(user_info)
-                count += 1
-            has_next = count >= limit
-            next_offset_id = offset + len(users) if has_next else None
-            logger.info(f"Fetched {len(users)} users for group {chat_id}, has_next: {has_next}")
-        return {"users": users, "next_offset_id": next_offset_id, "error": None}
+        for user_id in ids[bisect_right(ids, offset) if offset else 0:]:
+            user_info = roster["members"][user_id]
+            if needle and not any(needle in (user_info[field] or "").lower()
+                                  for field in ("first_name", "last_name", "username")):
+                continue
+            users.append(user_info)
+            if len(users) > limit:
+                break
+        has_next = len(users) > limit
+        users = users[:limit]
+        next_offset_id = users[-1]["id"] if has_next else None
+        logger.info("Fetched %s users for chat %s, has_next: %s", len(users), chat_id, has_next)
+        return {"users": users, "next_offset_id": next_offset_id, "total": roster["count"], "listed": len(ids),
+                "error": None}
+    except FloodWaitError as e:
+        logger.warning("FloodWaitError fetching users for chat %s, retry in %s seconds", chat_id, e.seconds)
+        raise rate_limit_error(e)
     except ChatAdminRequiredError:
-        logger.error(f"ChatAdminRequiredError for chat {chat_id}")
-        return {"users": [], "next_offset_id": None,
+        logger.error("ChatAdminRequiredError for chat %s", chat_id)
+        return {"users": [], "next_offset_id": None, "total": None, "listed": None,
                 "error": "Access to the user list is restricted. Administrative rights are required."}
     except Exception as e:
-        logger.error(f"Error fetching users for chat {chat_id}: {e}")
-        return {"users": [], "next_offset_id": None, "error": f"Failed to fetch users: {str(e)}"}
+        logger.error("Error fetching users for chat %s: %s", chat_id, e)
+        return {"users": [], "next_offset_id": None, "total": None, "listed": None,
+                "error": f"Failed to fetch users: {str(e)}"}
 
 
-# Helper: List all media files in a chat with full content
-async def get_chat_media(chat_id: int, limit: int = 20, offset_id: int = 0, thumbnail_only: bool = True):
+# Helper: List media files of one kind in a chat, linking each item to the /media endpoint.
+# Telegram filters by media kind server-side, so one page is one request of `limit` messages.
+@_helper_seconds.timed(helper="get_chat_media")
+async def get_chat_media(chat_id: int, limit: int = 20, offset_id: int = 0, thumbnail_only: bool = True,
+                         media_filter: str = "photo_video"):
     try:
-        logger.info(f"Fetching media for chat {chat_id} with limit {limit}, offset {offset_id}")
-        clean_media_cache()  # Clean old media files
+        logger.info("Fetching %s media for chat %s with limit %s, offset %s", media_filter, chat_id, limit, offset_id)
+        message_filter = _media_filters.get(media_filter, InputMessagesFilterPhotoVideo)
+        page = [msg async for msg in client.iter_messages(chat_id, limit=limit, offset_id=offset_id,
+                                                          filter=message_filter) if msg.media]
         media_files = []
-        messages_scanned = 0
-        async for msg in client.iter_messages(chat_id, limit=limit * 10, offset_id=offset_id, filter=None):
-            messages_scanned += 1
-            if msg.media:
-                sender = await msg.get_sender()
-                user_info = {
-                    "id": sender.id if sender else "Unknown",
-                    "first_name": getattr(sender, "first_name", "Unknown"),
-                    "last_name": getattr(sender, "last_name", ""),
-                    "username": getattr(sender, "username", "No username"),
-                    "phone": getattr(sender, "phone", "Hidden")
-                }
-                media_type = msg.media.__class__.__name__
-                logger.debug(f"Processing media {msg.id} of type {media_type}")
-                media_data = {}
-                try:
-                    media_bytes, media_type = await download_media(msg, thumbnail_only)
-                    if isinstance(msg.media, MessageMediaPhoto):
-                        media_data = {
-                            "type": "image",
-                            "base64": f"data:image/jpeg;base64,{base64.b64encode(media_bytes.getvalue()).decode('utf-8')}",
-                            "filename": None,
-                            "mime_type": "image/jpeg"
-                        }
-                    elif isinstance(msg.media, MessageMediaDocument):
-                        is_video = any(
-                            isinstance(attr, DocumentAttributeVideo) for attr in msg.media.document.attributes)
-                        is_audio = any(
-                            isinstance(attr, DocumentAttributeAudio) for attr in msg.media.document.attributes)
-                        filename = next((attr.file_name for attr in msg.media.document.attributes if
-                                         isinstance(attr, DocumentAttributeFilename)), "document")
-                        mime_type, _ = mimetypes.guess_type(filename)
-                        if is_video:
-                            media_data = {
-                                "type": "video",
-                                "base64": f"data:video/mp4;base64,{base64.b64encode(media_bytes.getvalue()).decode('utf-8')}",
-                                "filename": None,
-                                "mime_type": "video/mp4"
-                            }
-                        elif is_audio:
-                            media_data = {
-                                "type": "audio",
-                                "base64": f"data:audio/mpeg;base64,{base64.b64encode(media_bytes.getvalue()).decode('utf-8')}",
-                                "filename": filename,
-                                "mime_type": "audio/mpeg"
-                            }
-                        else:
-                            media_data = {
-                                "type": "document",
-                                "base64": f"data:{mime_type or 'application/octet-stream'};base64,{base64.b64encode(media_bytes.getvalue()).decode('utf-8')}",
-                                "filename": filename,
-                                "mime_type": mime_type or "application/octet-stream"
-                            }
-                    else:
-                        logger.warning(f"Unsupported media type {media_type} for message {msg.id}")
-                        media_data = {
-                            "type": "unsupported",
-                            "base64": None,
-                            "filename": None,
-                            "mime_type": None
-                        }
-                except Exception as e:
-                    logger.warning(f"Error downloading media {msg.id}: {e}")
-                    media_data = {
-                        "type": "error",
-                        "base64": None,
-                        "filename": None,
-                        "mime_type": None
-                    }
-                media_files.append({
-                    "id": msg.id,
-                    "type": media_type,
-                    "media_data": media_data,
-                    "date": msg.date,
-                    "user": user_info
+        for msg, user_info in zip(page, await get_message_users(page)):
+            media_type = msg.media.__class__.__name__
+            logger.debug("Processing media %s of type %s", msg.id, media_type)
+            media_data = describe_media(msg.media)
+            if media_data["type"] == "unsupported":
+                logger.warning("Unsupported media type %s for message %s", media_type, msg.id)
+                media_data.update({"url": None, "thumb_url": None})
+            else:
+                remember_media_message(msg)
+                media_url = f"/media/{chat_id}/{msg.id}"
+                has_thumb = pick_thumbnail(msg.media) is not None
+                media_data.update({
+                    "url": media_url,
+                    "thumb_url": (f"/preview/{chat_id}/{msg.id}" if _preview_renderer.available else
+                                  f"{media_url}?thumb=1") if has_thumb and thumbnail_only else None
                 })
-            if len(media_files) >= limit:
-                break
+            media_files.append({
+                "id": msg.id,
+                "type": media_type,
+                "media_data": media_data,
+                "date": msg.date,
+                "user": user_info
+            })
+        if thumbnail_only:
+            prefetch_thumbnails(page)
         next_offset_id = media_files[-1]["id"] if media_files and len(media_files) == limit else None
-        logger.info(f"Fetched {len(media_files)} media files for chat {chat_id}, scanned {messages_scanned} messages")
-        return {"media_files": media_files[:limit], "next_offset_id": next_offset_id}
+        logger.info("Fetched %s media files for chat %s", len(media_files), chat_id)
+        return {"media_files": media_files, "next_offset_id": next_offset_id}
+    except FloodWaitError as e:
+        logger.warning("FloodWaitError fetching media for chat %s, retry in %s seconds", chat_id, e.seconds)
+        raise rate_limit_error(e)
     except Exception as e:
-        logger.error(f"Error fetching media for chat {chat_id}: {e}")
+        logger.error("Error fetching media for chat %s: %s", chat_id, e)
         raise HTTPException(status_code=500, detail="Failed to fetch media files")
 
 
-# Incoming message handler (logging group messages with user info)
-@client.on(NewMessage(incoming=True))
+# Media endpoint: serve a message's media from the disk cache or Telegram, with Range support
+@app.get("/media/{chat_id}/{message_id}")
+async def serve_media(request: Request, chat_id: int, message_id: int, thumb: bool = False):
+    await checked_tab_chat("media", chat_id)
+    message = await get_media_message(chat_id, message_id)
+    if message is None or not message.media:
+        raise HTTPException(status_code=404, detail="Media not found")
+    media_info = describe_media(message.media)
+    if media_info["type"] == "unsupported" or (thumb and pick_thumbnail(message.media) is None):
+        raise HTTPException(status_code=404, detail="Media not found")
+
+    cache_key = media_cache_key(message.media, thumb)
+    etag = f'"{cache_key}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=86400", "Accept-Ranges": "bytes"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    cache_file = await _media_cache.get(cache_key)
+    size = None if thumb else media_info["size"]
+    if cache_file is None and size is None:
+        # Photos and thumbnails are small and have no size up front: fetch them whole into the cache
+        try:
+            cache_file = await download_media(message, thumbnail_only=thumb)
+        except FloodWaitError as e:
+            raise rate_limit_error(e)
+        except Exception as e:
+            logger.warning("Error downloading media %s in chat %s: %s", message_id, chat_id, e)
+            raise HTTPException(status_code=502, detail="Failed to download media")
+    cached_file = None
+    if cache_file:
+        cached_file = await asyncio.to_thread(open, cache_file, "rb")
+        size = os.fstat(cached_file.fileno()).st_size
+
+    try:
+        byte_range = parse_range_header(request.headers.get("range"), size)
+    except HTTPException:
+        if cached_file:
+            cached_file.close()
+        raise
+    start, end = byte_range if byte_range else (0, size - 1)
+    headers["Content-Length"] = str(end - start + 1)
+    if media_info["filename"] and not thumb:
+        headers["Content-Disposition"] = f"inline; filename*=UTF-8''{quote(media_info['filename'])}"
+    status_code = 200
+    if byte_range:
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    fill = _media_cache.filling(cache_key)
+    if cached_file:
+        body = iter_file_range(cached_file, start, end)
+    elif size <= _max_cached_media_size and (start == 0 or (fill is not None and start <= fill.written)):
+        body = iter_cache_fill(message, cache_key, start, end)
+    else:
+        body = iter_telegram_range(message, start, end, size)
+    media_type = "image/jpeg" if thumb else media_info["mime_type"]
+    return StreamingResponse(body, status_code=status_code, media_type=media_type, headers=headers)
+
+
+# Preview endpoint: fixed-size WebP (or JPEG) grid previews; the full original is only fetched via
+# /media when the viewer opens. Falls back to Telegram's thumbnail if a preview can't be rendered.
+@app.get("/preview/{chat_id}/{message_id}")
+async def serve_preview(request: Request, chat_id: int, message_id: int):
+    await checked_tab_chat("media", chat_id)
+    message = await get_media_message(chat_id, message_id)
+    if message is None or not message.media or pick_thumbnail(message.media) is None:
+        raise HTTPException(status_code=404, detail="Preview not found")
+    if not _preview_renderer.available:
+        return RedirectResponse(url=f"/media/{chat_id}/{message_id}?thumb=1", status_code=307)
+    fmt = _preview_renderer.pick_format(request.headers.get("accept"))
+    etag = f'"{media_cache_key(message.media, variant=f"preview_{_preview_renderer.max_side}.{fmt}")}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=604800, immutable", "Vary": "Accept"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    try:
+        cache_file = await get_preview(message, fmt)
+    except FloodWaitError as e:
+        raise rate_limit_error(e)
+    except Exception as e:
+        logger.warning("Error rendering preview of message %s in chat %s: %s", message_id, chat_id, e)
+        return RedirectResponse(url=f"/media/{chat_id}/{message_id}?thumb=1", status_code=307)
+    data = await asyncio.to_thread(read_cached_file, cache_file)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Preview not found")
+    return Response(content=data, media_type=PREVIEW_MIME_TYPES[fmt], headers=headers)
+
+
+# Avatar endpoint: profile photos by URL; the photo id in the path makes each URL immutable
+@app.get("/avatar/{peer_id}/{photo_id}")
+async def serve_avatar(request: Request, peer_id: int, photo_id: int):
+    etag = f'"{peer_id}-{photo_id}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=604800, immutable"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    data = await download_profile_photo(peer_id, photo_id)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Profile photo not found")
+    return Response(content=data, media_type="image/jpeg", headers=headers)
+
+
+# Helper: Sender info for a live event, from the user cache when possible
+async def event_user_info(event) -> dict:
+    user_info = get_cached_user(event.sender_id) if event.sender_id is not None else None
+    if user_info is None:
+        sender = await event.get_sender()
+        user_info = cache_user(sender) if sender else build_user_info(None)
+    return user_info
+
+
+# Helper: Message dict as shown in the messages tab, plus its rendered HTML for live subscribers
+def live_message(msg, user_info: dict) -> dict:
+    message = {"content": msg.text if msg.text else f"[Media: {msg.media.__class__.__name__}]",
+               "date": msg.date, "id": msg.id, "user": user_info}
+    message["html"] = templates.get_template("_message.html").render(msg=message)
+    return message
+
+
+# Group message handler: index, fan out to live subscribers, and log incoming messages with user info
+@on_update(NewMessage())
 async def handle_message(event):
     if event.is_group or event.is_channel:
-        sender = await event.get_sender()
+        await index_messages(event.chat_id, [event.message])
+        if not (event.message.text or event.message.media):
+            return
+        user_info = await event_user_info(event)
+        publish_live(event.chat_id, "message", live_message(event.message, user_info))
         text = event.raw_text
-        if text.strip():
-            user_info = {
-                "id": sender.id,
-                "first_name": getattr(sender, "first_name", "Unknown"),
-                "last_name": getattr(sender, "last_name", ""),
-                "username": getattr(sender, "username", "No username"),
-                "phone": getattr(sender, "phone", "Hidden")
-            }
-            logger.info(f"Group Message from {user_info} in {event.chat_id}: {text}")
+        if not event.out and text.strip() and _message_log_sampler.allow(event.chat_id):
+            logger.info("Group message in %s from %s", event.chat_id, user_info["id"],
+                        extra={"chat_id": event.chat_id, "message_id": event.message.id, "sender": user_info,
+                               "text": text[:_message_log_text_max]})
+
+
+# Keep the local message index and live subscribers in sync with edits and deletions
+@on_update(MessageEdited())
+async def handle_message_edit(event):
+    if event.is_group or event.is_channel:
+        await index_messages(event.chat_id, [event.message])
+        if event.message.text or event.message.media:
+            publish_live(event.chat_id, "edit", live_message(event.message, await event_user_info(event)))
+
+
+@on_update(MessageDeleted())
+async def handle_message_delete(event):
+    await asyncio.to_thread(_message_index.delete_messages, event.chat_id, event.deleted_ids)
+    remove_live_messages(event.chat_id, event.deleted_ids)
+    notify_workers("live_remove", event.chat_id, event.deleted_ids)
+
+
+# Helper: Send a new or edited message to this process's live subscribers and to the workers'
+def publish_live(chat_id: int, event: str, message: dict):
+    _live_feed.publish(chat_id, event, message)
+    notify_workers("live", chat_id, event, message)
+
+
+# Helper: The client receiving updates reconnected after a drop. Messages may have been missed
+# meanwhile, so the live buffers (here and in workers) no longer hold a chat's latest messages.
+def telegram_reconnected(telegram_client):
+    if isinstance(client, ClientPool) and telegram_client is not client.primary:
+        return
+    logger.warning("Telegram connection was restored, clearing the live message buffers")
+    _live_feed.clear()
+    notify_workers("live_clear")
+
+
+# Helper: Drop deleted messages from the live feed
+def remove_live_messages(chat_id: int | None, message_ids: list[int]):
+    if chat_id is not None:
+        _live_feed.remove(chat_id, message_ids)
+    else:
+        # Basic groups share one account-wide message id space and deletions carry no chat id
+        for buffered_chat_id in _live_feed.buffered_chats():
+            if not is_channel_id(buffered_chat_id):
+                _live_feed.remove(buffered_chat_id, message_ids)
+
+
+# Helper: One server-sent event
+def sse_event(event: str, message: dict) -> str:
+    if event == "delete":
+        return f"event: delete\ndata: {json.dumps(message)}\n\n"
+    payload = json.dumps({"id": message["id"], "html": message["html"]})
+    return f"event: {event}\nid: {message['id']}\ndata: {payload}\n\n"
+
+
+# Live feed endpoint: new, edited and deleted messages of a chat as server-sent events.
+# Reconnecting browsers send Last-Event-ID and get what they missed from the ring buffer.
+@app.get("/events/{chat_id}")
+async def live_events(request: Request, chat_id: int):
+    await checked_tab_chat("messages", chat_id)
+    last_event_id = request.headers.get("last-event-id", "")
+    queue = _live_feed.subscribe(chat_id)
+
+    async def stream():
+        try:
+            if last_event_id.isdigit():
+                for message in _live_feed.since(chat_id, int(last_event_id)):
+                    yield sse_event("message", message)
+            while True:
+                try:
+                    event, message = await asyncio.wait_for(queue.get(), timeout=_live_heartbeat)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+                yield sse_event(event, message)
+        finally:
+            _live_feed.unsubscribe(chat_id, queue)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# Helper: One exported message as a JSON line, with its sender and (when exported) its media file
+def export_record(msg, sender: dict | None, media: dict | None) -> str:
+    if sender is not None:
+        sender = {key: value for key, value in sender.items() if key != "profile_photo"}
+    action = getattr(msg, "action", None)
+    edit_date = getattr(msg, "edit_date", None)
+    return json.dumps({
+        "id": msg.id,
+        "date": msg.date.isoformat(),
+        "edit_date": edit_date.isoformat() if edit_date else None,
+        "sender_id": msg.sender_id,
+        "sender": sender,
+        "text": msg.text or "",
+        "reply_to": getattr(msg, "reply_to_msg_id", None),
+        "action": action.__class__.__name__ if action else None,
+        "media": media
+    }, ensure_ascii=False)
+
+
+# Helper: File name for a message's media inside an export
+def export_media_name(msg, media_info: dict) -> str:
+    if media_info["filename"]:
+        return f"{msg.id}_{os.path.basename(media_info['filename'])}"
+    return f"{msg.id}{mimetypes.guess_extension(media_info['mime_type'] or '') or '.bin'}"
+
+
+# Helper: Add a message's media to an export via the media cache (files already cached cost no
+# requests); downloads run at prefetch priority so browsing the UI is not held up by exports
+async def export_media(export, msg) -> dict:
+    media_info = describe_media(msg.media)
+    media = {"type": media_info["type"], "mime_type": media_info["mime_type"], "size": media_info["size"],
+             "file": None}
+    if media_info["type"] == "unsupported":
+        media["type"] = msg.media.__class__.__name__
+        return media
+    if media_info["size"] is not None and media_info["size"] > _max_cached_media_size:
+        media["skipped"] = "too large"
+        return media
+    cache_key = media_cache_key(msg.media)
+    if await _media_cache.get(cache_key) is None:
+        await _export_budget.acquire(max(1, -(-(media_info["size"] or 0) // _media_chunk_size)))
+    try:
+        cache_file = await download_media(msg, priority=PRIORITY_PREFETCH)
+        name = export_media_name(msg, media_info)
+        media["size"] = await asyncio.to_thread(export.add_media_file, cache_file, name)
+        media["file"] = f"media/{name}"
+    except FloodWaitError:
+        raise
+    except Exception as e:
+        logger.warning("Error exporting media of message %s in chat %s: %s", msg.id, export.chat_id, e)
+        media["skipped"] = str(e)
+    return media
+
+
+# Helper: Export a chat oldest message first, one batch per request within the export budget.
+# Each batch is checkpointed after it is on disk, so flood waits and restarts resume after the
+# last exported message.
+async def export_chat(export):
+    state = export.state
+    await asyncio.to_thread(export.truncate_to_checkpoint)
+    while True:
+        try:
+            if state["total_messages"] is None:
+                await _export_budget.acquire()
+                state["total_messages"] = (await client.get_messages(export.chat_id, limit=0)).total
+            await _export_budget.acquire()
+            batch = [msg async for msg in client.iter_messages(export.chat_id, limit=_export_batch_size,
+                                                               min_id=state["last_id"], reverse=True)]
+            if not batch:
+                return
+            senders = await resolve_senders(batch)
+            lines = []
+            media_files = media_bytes = media_skipped = 0
+            for msg in batch:
+                media = await export_media(export, msg) if state["include_media"] and msg.media else None
+                if media and media["file"]:
+                    media_files += 1
+                    media_bytes += media["size"]
+                elif media and media.get("skipped"):
+                    media_skipped += 1
+                lines.append(export_record(msg, senders.get(msg.sender_id), media))
+        except FloodWaitError as e:
+            logger.warning("FloodWaitError exporting chat %s, resuming in %s seconds", export.chat_id, e.seconds)
+            _download_scheduler.flood_wait(e.seconds)
+            state.update(status=STATUS_WAITING, retry_at=time.time() + e.seconds)
+            await asyncio.to_thread(export.save)
+            await asyncio.sleep(e.seconds)
+            continue
+        state["jsonl_bytes"] = await asyncio.to_thread(export.append_lines, lines)
+        state.update(status=STATUS_RUNNING, retry_at=None, last_id=batch[-1].id,
+                     messages=state["messages"] + len(batch),
+                     media_files=state["media_files"] + media_files,
+                     media_bytes=state["media_bytes"] + media_bytes,
+                     media_skipped=state["media_skipped"] + media_skipped)
+        await asyncio.to_thread(export.save)
+        logger.debug("Exported %s messages of chat %s", state["messages"], export.chat_id)
+
+
+# Background job around export_chat. Cancellation leaves the status as it is: the cancel endpoint
+# sets it first, and exports interrupted by shutdown stay "running" so the next startup resumes them.
+async def run_export(export):
+    try:
+        await export_chat(export)
+        export.state.update(status=STATUS_DONE, retry_at=None)
+        logger.info("Exported %s messages of chat %s", export.state["messages"], export.chat_id)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error("Error exporting chat %s: %s", export.chat_id, e)
+        export.state.update(status=STATUS_FAILED, error=str(e))
+    finally:
+        await asyncio.to_thread(export.save)
+
+
+def start_export(export):
+    task = _export_tasks.get(export.chat_id)
+    if task is not None and not task.done():
+        return
+    export.state.update(status=STATUS_RUNNING, error=None)
+    task = asyncio.create_task(run_export(export))
+    _export_tasks[export.chat_id] = task
+    task.add_done_callback(lambda t: _export_tasks.pop(export.chat_id, None))
+    logger.info("Started export of chat %s from message %s", export.chat_id, export.state["last_id"])
+
+
+def resume_exports():
+    if _rpc_client is not None:
+        return  # Exports run in the owner process
+    for export in _export_store.all():
+        if export.state["status"] in (STATUS_RUNNING, STATUS_WAITING):
+            start_export(export)
+
+
+# Owner side of the export endpoints (workers reach these through on_owner)
+async def start_chat_export(chat_id: int, media: bool, restart: bool) -> dict:
+    export = _export_store.get(chat_id)
+    if export is None or restart or (export.state["status"] == STATUS_DONE and
+                                     export.state["include_media"] != media):
+        task = _export_tasks.get(chat_id)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        export = await asyncio.to_thread(_export_store.create, chat_id, media)
+    if export.state["status"] != STATUS_DONE:
+        start_export(export)
+    return export.progress()
+
+
+async def list_chat_exports() -> list[dict]:
+    return [export.progress() for export in _export_store.all()]
+
+
+async def chat_export_progress(chat_id: int) -> dict | None:
+    export = _export_store.get(chat_id)
+    return export.progress() if export else None
+
+
+async def cancel_chat_export(chat_id: int) -> dict | None:
+    export = _export_store.get(chat_id)
+    if export is None:
+        return None
+    task = _export_tasks.get(chat_id)
+    if task is not None:
+        export.state["status"] = STATUS_CANCELLED
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    return export.progress()
+
+
+# Export endpoints: start or resume a chat export, follow its progress, cancel it, and download the
+# finished archive (messages.jsonl plus media/, zipped while it streams)
+@app.post("/export/{chat_id}", status_code=202)
+async def create_export(chat_id: int, media: bool = False, restart: bool = False):
+    await checked_tab_chat("messages", chat_id)
+    return await on_owner(start_chat_export, chat_id, media, restart)
+
+
+@app.get("/exports")
+async def list_exports():
+    return await on_owner(list_chat_exports)
+
+
+@app.get("/export/{chat_id}")
+async def export_progress(chat_id: int):
+    progress = await on_owner(chat_export_progress, chat_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="No export for this chat")
+    return progress
+
+
+@app.post("/export/{chat_id}/cancel")
+async def cancel_export(chat_id: int):
+    progress = await on_owner(cancel_chat_export, chat_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="No export for this chat")
+    return progress
+
+
+# The archive is read straight from the export directory, which workers share with the owner
+@app.get("/export/{chat_id}/archive")
+async def export_archive(chat_id: int, format: str = Query(default="zip", pattern="^(zip|jsonl)$")):
+    progress = await on_owner(chat_export_progress, chat_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="No export for this chat")
+    export = ChatExport(_export_store.path(chat_id), progress)
+    if export.state["status"] != STATUS_DONE:
+        raise HTTPException(status_code=409, detail=f"Export is {export.state['status']}")
+    if format == "jsonl":
+        messages_file = await asyncio.to_thread(open, export.messages_path, "rb")
+        return StreamingResponse(iter_file_range(messages_file, 0, export.state["jsonl_bytes"] - 1),
+                                 media_type="application/x-ndjson",
+                                 headers={"Content-Disposition": f'attachment; filename="chat_{chat_id}.jsonl"',
+                                          "Content-Length": str(export.state["jsonl_bytes"])})
+    files = await asyncio.to_thread(export.archive_files)
+    return StreamingResponse(iter_zip(files), media_type="application/zip",
+                             headers={"Content-Disposition": f'attachment; filename="chat_{chat_id}.zip"'})
 
 
 # Reset chat selection
@@ -444,6 +1896,47 @@ async def reset_chat(request: Request):
     return RedirectResponse(url="/", status_code=303)
 
 
+# Helper: Load one tab's data for the selected chat into a template context
+@_helper_seconds.timed(helper="load_tab")
+async def load_tab(tab: str, chat_id: int | None, query: str = None, start_date: str = None, end_date: str = None,
+                   offset_id: int = 0, limit: int = 20, media_filter: str = "photo_video") -> dict:
+    context = {
+        "tab": tab,
+        "active_chat": chat_id,
+        "query": query,
+        "start_date": start_date,
+        "end_date": end_date,
+        "offset_id": offset_id,
+        "limit": limit,
+        "media_filter": media_filter if media_filter in _media_filters else "photo_video",
+        "messages": [],
+        "messages_synced_at": None,
+        "next_offset_id": offset_id,
+        "users": [],
+        "users_total": None,
+        "users_listed": None,
+        "users_error": None,
+        "media_files": [],
+        "media_next_offset_id": offset_id
+    }
+    if not chat_id:
+        return context
+    if tab == "messages":
+        result = await get_last_messages(chat_id, limit=limit, offset_id=offset_id, query=query,
+                                         start_date=start_date, end_date=end_date)
+        context.update(messages=result["messages"], messages_synced_at=result["synced_at"],
+                       next_offset_id=result["next_offset_id"])
+    elif tab == "users":
+        users_data = await get_chat_users(chat_id, limit=limit, offset=offset_id, query=query)
+        context.update(users=users_data["users"], users_total=users_data["total"], users_listed=users_data["listed"],
+                       users_error=users_data["error"], next_offset_id=users_data["next_offset_id"])
+    elif tab == "media":
+        result = await get_chat_media(chat_id, limit=limit, offset_id=offset_id, thumbnail_only=True,
+                                      media_filter=context["media_filter"])
+        context.update(media_files=result["media_files"], media_next_offset_id=result["next_offset_id"])
+    return context
+
+
 # Main chat UI with search and date filters for group chats
 @app.get("/", response_class=HTMLResponse)
 async def form(
@@ -454,9 +1947,10 @@ async def form(
         end_date: str = None,
         offset_id: int = Query(default=0, ge=0),
         limit: int = Query(default=20, ge=1, le=100),
-        tab: str = Query(default="messages")
+        tab: str = Query(default="messages"),
+        media_filter: str = Query(default="photo_video")
 ):
-    logger.info(f"Handling request for tab {tab}, chat_id {chat_id}, offset {offset_id}, limit {limit}")
+    logger.info("Handling request for tab %s, chat_id %s, offset %s, limit %s", tab, chat_id, offset_id, limit)
 
     # Load saved chat_id if none provided and none in session
     if chat_id is None and "chat_id" not in request.session:
@@ -472,53 +1966,77 @@ async def form(
     elif "chat_id" in request.session:
         chat_id = request.session["chat_id"]
 
-    groups = await get_group_chats()
+    # With the group list cached, check the chat is one of ours before loading anything for it.
+    # On a cold cache the group list and the tab's data load concurrently, and a tab loaded for a
+    # chat that turns out not to be a group is thrown away.
+    context = None
+    if _groups_cache is not None:
+        groups = await get_group_chats()
+    else:
+        groups, context = await asyncio.gather(
+            get_group_chats(),
+            load_tab(tab, chat_id, query, start_date, end_date, offset_id, limit, media_filter),
+            return_exceptions=True)
+        if isinstance(groups, BaseException):
+            raise groups
+    if chat_id is not None and not is_group_chat(chat_id):
+        logger.warning("Invalid chat_id %s, resetting session", chat_id)
+        request.session.pop("chat_id", None)
+        save_selected_chat(None)
+        chat_id = None
+        context = None
+    if context is None:
+        context = await load_tab(tab, chat_id, query, start_date, end_date, offset_id, limit, media_filter)
+    elif isinstance(context, BaseException):
+        raise context
+
+    logger.info("Rendering template for tab %s with %s messages, %s users, %s media files",
+                tab, len(context["messages"]), len(context["users"]), len(context["media_files"]))
+    with _helper_seconds.time(helper="render_index"):
+        return templates.TemplateResponse(request, "index.html", {"groups": groups, **context})
+
+
+# Helper: Shared validation for the per-tab endpoints
+async def checked_tab_chat(tab: str, chat_id: int | None) -> int | None:
+    if tab not in _tabs:
+        raise HTTPException(status_code=404, detail=f"Unknown tab: {tab}")
     if chat_id is not None:
-        valid_chat_ids = [group["id"] for group in groups]
-        if chat_id not in valid_chat_ids:
-            logger.warning(f"Invalid chat_id {chat_id}, resetting session")
-            request.session.pop("chat_id", None)
-            save_selected_chat(None)
-            chat_id = None
-
-    messages = []
-    next_offset_id = offset_id
-    users_data = {"users": [], "next_offset_id": offset_id, "error": None}
-    media_files = []
-    media_next_offset_id = offset_id
-
-    # Process data only for the selected chat
-    if chat_id:
-        if tab == "messages":
-            result = await get_last_messages(chat_id, limit=limit, offset_id=offset_id, query=query,
-                                             start_date=start_date,
-                                             end_date=end_date)
-            messages = result["messages"]
-            next_offset_id = result["next_offset_id"]
-        elif tab == "users":
-            users_data = await get_chat_users(chat_id, limit=limit, offset=offset_id)
-            next_offset_id = users_data["next_offset_id"]
-        elif tab == "media":
-            result = await get_chat_media(chat_id, limit=limit, offset_id=offset_id, thumbnail_only=True)
-            media_files = result["media_files"]
-            media_next_offset_id = result["next_offset_id"]
-
-    logger.info(
-        f"Rendering template for tab {tab} with {len(messages)} messages, {len(users_data['users'])} users, {len(media_files)} media files")
-    return templates.TemplateResponse("index.html", {
-        "request": request,
-        "groups": groups,
-        "messages": messages,
-        "users": users_data["users"],
-        "users_error": users_data["error"],
-        "media_files": media_files,
-        "active_chat": chat_id,
-        "query": query,
-        "start_date": start_date,
-        "end_date": end_date,
-        "offset_id": offset_id,
-        "next_offset_id": next_offset_id,
-        "media_next_offset_id": media_next_offset_id,
-        "limit": limit,
-        "tab": tab
-    })
\ No newline at end of file
+        await get_group_chats()
+        if not is_group_chat(chat_id):
+            raise HTTPException(status_code=404, detail=f"Unknown chat: {chat_id}")
+    return chat_id
+
+
+# Per-tab endpoints: one tab's data as JSON, or as the HTML fragment the page swaps in on pagination
+# and tab switches, so the page shell and group list are rendered only once
+@app.get("/api/{tab}")
+async def tab_json(
+        tab: str,
+        chat_id: int = None,
+        query: str = None,
+        start_date: str = None,
+        end_date: str = None,
+        offset_id: int = Query(default=0, ge=0),
+        limit: int = Query(default=20, ge=1, le=100),
+        media_filter: str = Query(default="photo_video")
+):
+    chat_id = await checked_tab_chat(tab, chat_id)
+    return await load_tab(tab, chat_id, query, start_date, end_date, offset_id, limit, media_filter)
+
+
+@app.get("/fragment/{tab}", response_class=HTMLResponse)
+async def tab_fragment(
+        request: Request,
+        tab: str,
+        chat_id: int = None,
+        query: str = None,
+        start_date: str = None,
+        end_date: str = None,
+        offset_id: int = Query(default=0, ge=0),
+        limit: int = Query(default=20, ge=1, le=100),
+        media_filter: str = Query(default="photo_video")
+):
+    chat_id = await checked_tab_chat(tab, chat_id)
+    context = await load_tab(tab, chat_id, query, start_date, end_date, offset_id, limit, media_filter)
+    with _helper_seconds.time(helper="render_fragment"):
+        return templates.TemplateResponse(request, f"_{tab}.html", context)
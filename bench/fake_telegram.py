@@ -0,0 +1,256 @@
+import asyncio
+import math
+import random
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from telethon.errors import FloodWaitError
+from telethon.helpers import TotalList
+from telethon.tl.types import Channel, User, UserProfilePhoto, Photo, PhotoSize, Document, MessageMediaPhoto, \
+    MessageMediaDocument, DocumentAttributeFilename, DocumentAttributeVideo, DocumentAttributeAudio, ChatPhotoEmpty, \
+    InputMessagesFilterPhotoVideo, InputMessagesFilterDocument, InputMessagesFilterMusic
+from telethon.utils import get_peer_id
+
+_WORDS = ("hello", "meeting", "photo", "release", "deploy", "lunch", "report", "question", "thanks", "update",
+          "weekend", "invoice", "bug", "review", "coffee", "ticket", "draft", "plan", "budget", "link")
+_SELF_ID = 999999
+_EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class _TotalList(list):
+    total = 0
+
+
+# In-process stand-in for TelegramClient, covering the calls app.py makes. Chats, members and
+# messages are generated deterministically on demand from their ids, so a large synthetic history
+# costs no memory. Each simulated API request sleeps for the configured latency, may raise a
+# FloodWaitError, and is counted by method in `calls`. As on Telegram, the account then stays
+# flood-limited until the wait is over.
+class FakeTelegramClient:
+    def __init__(self, chats: int = 5, messages_per_chat: int = 5000, members_per_chat: int = 500,
+                 media_ratio: float = 0.3, photo_size: int = 128 * 1024, document_size: int = 2 * 1024 * 1024,
+                 latency: float = 0.05, jitter: float = 0.5, flood_rate: float = 0.0, flood_seconds: int = 1,
+                 seed: int = 1):
+        self.messages_per_chat = messages_per_chat
+        self.members_per_chat = members_per_chat
+        self.media_ratio = media_ratio
+        self.photo_size = photo_size
+        self.document_size = document_size
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.seed = seed
+        self.calls = Counter()
+        self._rng = random.Random(seed)
+        self._flood_until = 0.0
+        self._channels = {}  # peer id -> Channel
+        for i in range(chats):
+            channel = Channel(id=1000 + i, title=f"Group {i}", photo=ChatPhotoEmpty(), date=_EPOCH, megagroup=True,
+                              creator=False, left=False, access_hash=i + 1, username=f"group{i}" if i % 2 else None)
+            self._channels[get_peer_id(channel)] = channel
+
+    @property
+    def chat_ids(self) -> list[int]:
+        return list(self._channels)
+
+    # One simulated API request: count it, maybe fail it with a flood wait, then wait out the latency
+    async def _request(self, method: str):
+        self.calls[method] += 1
+        now = time.monotonic()
+        if now < self._flood_until:
+            self.calls["flood_wait"] += 1
+            raise FloodWaitError(request=None, capture=math.ceil(self._flood_until - now))
+        if self.flood_rate and self._rng.random() < self.flood_rate:
+            self.calls["flood_wait"] += 1
+            self._flood_until = now + self.flood_seconds
+            raise FloodWaitError(request=None, capture=self.flood_seconds)
+        if self.latency:
+            await asyncio.sleep(self.latency * self._rng.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def _chat_index(self, chat_id: int) -> int:
+        channel = self._channels.get(chat_id)
+        if channel is None:
+            raise ValueError(f"Unknown chat {chat_id}")
+        return channel.id - 1000
+
+    def user(self, user_id: int) -> User:
+        photo = UserProfilePhoto(photo_id=user_id * 10 + 1, dc_id=2) if user_id % 4 else None
+        return User(id=user_id, access_hash=user_id, first_name=f"User{user_id}", last_name=_WORDS[user_id % 20],
+                    username=f"user{user_id}", photo=photo)
+
+    # Members of a chat: consecutive user ids, with neighbouring chats sharing half their members
+    def member_ids(self, chat_id: int) -> range:
+        first = 1 + self._chat_index(chat_id) * self.members_per_chat // 2
+        return range(first, first + self.members_per_chat)
+
+    def message(self, chat_id: int, message_id: int):
+        if not 1 <= message_id <= self.messages_per_chat:
+            return None
+        rng = random.Random(f"{self.seed}:{chat_id}:{message_id}")
+        members = self.member_ids(chat_id)
+        sender = self.user(members[rng.randrange(len(members))])
+        date = _EPOCH + timedelta(minutes=message_id)
+        file_id = (self._chat_index(chat_id) + 1) * 10 ** 9 + message_id
+        media = None
+        text = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(3, 20)))
+        if rng.random() < self.media_ratio:
+            kind = rng.choice(("photo", "photo", "video", "document", "audio"))
+            if kind == "photo":
+                sizes = [PhotoSize(type="m", w=320, h=240, size=self.photo_size // 16),
+                         PhotoSize(type="y", w=1280, h=960, size=self.photo_size)]
+                media = MessageMediaPhoto(photo=Photo(id=file_id, access_hash=file_id, file_reference=b"", date=date,
+                                                      sizes=sizes, dc_id=2))
+            else:
+                attributes, mime_type = {
+                    "video": ([DocumentAttributeVideo(duration=30, w=1280, h=720)], "video/mp4"),
+                    "document": ([DocumentAttributeFilename(file_name=f"report_{message_id}.pdf")], "application/pdf"),
+                    "audio": ([DocumentAttributeAudio(duration=180, title="Track"),
+                               DocumentAttributeFilename(file_name=f"track_{message_id}.mp3")], "audio/mpeg")
+                }[kind]
+                thumbs = [PhotoSize(type="m", w=320, h=180, size=self.photo_size // 16)] if kind != "audio" else None
+                media = MessageMediaDocument(document=Document(
+                    id=file_id, access_hash=file_id, file_reference=b"", date=date, mime_type=mime_type,
+                    size=self.document_size, dc_id=2, attributes=attributes, thumbs=thumbs))
+            if rng.random() < 0.5:
+                text = ""
+        return SimpleNamespace(id=message_id, chat_id=chat_id, date=date, edit_date=None, text=text, raw_text=text,
+                               media=media, sender_id=sender.id, sender=sender, input_sender=None, out=False,
+                               action=None, reply_to_msg_id=None)
+
+    @staticmethod
+    def _matches_filter(media, message_filter) -> bool:
+        if message_filter is None:
+            return True
+        if isinstance(media, MessageMediaPhoto):
+            return message_filter is InputMessagesFilterPhotoVideo
+        if not isinstance(media, MessageMediaDocument):
+            return False
+        attributes = media.document.attributes
+        if any(isinstance(attr, DocumentAttributeVideo) for attr in attributes):
+            return message_filter in (InputMessagesFilterPhotoVideo, InputMessagesFilterDocument)
+        if any(isinstance(attr, DocumentAttributeAudio) for attr in attributes):
+            return message_filter in (InputMessagesFilterMusic, InputMessagesFilterDocument)
+        return message_filter is InputMessagesFilterDocument
+
+    # Lifecycle and auth
+    async def connect(self):
+        pass
+
+    async def disconnect(self):
+        pass
+
+    def is_connected(self) -> bool:
+        return True
+
+    async def is_user_authorized(self) -> bool:
+        return True
+
+    async def send_code_request(self, phone):
+        await self._request("send_code_request")
+
+    async def sign_in(self, phone=None, code=None, **kwargs):
+        await self._request("sign_in")
+
+    def on(self, event):
+        return lambda handler: handler
+
+    def add_event_handler(self, handler, event=None):
+        pass
+
+    async def get_peer_id(self, peer) -> int:
+        return _SELF_ID if peer == "me" else get_peer_id(peer)
+
+    # Dialogs, messages and participants, paged like Telethon's iterators (100 dialogs or messages,
+    # 200 participants per request); the server-side search and filters decide what a page holds
+    async def iter_dialogs(self, limit=None):
+        channels = list(self._channels.values())
+        for start in range(0, max(len(channels), 1), 100):
+            await self._request("iter_dialogs")
+            for channel in channels[start:start + 100]:
+                yield SimpleNamespace(entity=channel, name=channel.title, id=get_peer_id(channel))
+
+    async def iter_messages(self, chat_id, limit=None, offset_id=0, offset_date=None, search=None, filter=None,
+                            min_id=0, reverse=False, **kwargs):
+        self._chat_index(chat_id)
+        needle = search.lower() if search else None
+        yielded = 0
+        newest_id = min(offset_id - 1 if offset_id else self.messages_per_chat, self.messages_per_chat)
+        # Newest first by default; oldest first from min_id with reverse=True
+        message_ids = iter(range(max(min_id, 0) + 1, newest_id + 1) if reverse else
+                           range(newest_id, max(min_id, 0), -1))
+        message_id = next(message_ids, None)
+        while limit is None or yielded < limit:
+            await self._request("iter_messages")
+            page = 0
+            while page < 100 and message_id is not None and (limit is None or yielded < limit):
+                msg = self.message(chat_id, message_id)
+                message_id = next(message_ids, None)
+                if offset_date and msg.date >= offset_date:
+                    continue
+                if needle and needle not in msg.text.lower():
+                    continue
+                if not self._matches_filter(msg.media, filter):
+                    continue
+                page += 1
+                yielded += 1
+                yield msg
+            if message_id is None:
+                return
+
+    async def get_messages(self, chat_id, ids=None, limit=None, **kwargs):
+        await self._request("get_messages")
+        if ids is None:
+            # Like Telethon's TotalList: the page plus the chat's total message count
+            page = _TotalList(filter(None, (self.message(chat_id, self.messages_per_chat - i)
+                                            for i in range(limit or 0))))
+            page.total = self.messages_per_chat
+            return page
+        if isinstance(ids, list):
+            return [self.message(chat_id, message_id) for message_id in ids]
+        return self.message(chat_id, ids)
+
+    async def iter_participants(self, chat_id, limit=None, **kwargs):
+        member_ids = self.member_ids(chat_id)
+        for start in range(0, len(member_ids), 200):
+            await self._request("iter_participants")
+            for user_id in member_ids[start:start + 200]:
+                yield self.user(user_id)
+
+    # limit=0 is the member count alone, like Telethon's participants_count lookup
+    async def get_participants(self, chat_id, limit=None, **kwargs):
+        await self._request("get_participants")
+        member_ids = self.member_ids(chat_id)
+        users = TotalList(self.user(user_id) for user_id in member_ids[:limit])
+        users.total = len(member_ids)
+        return users
+
+    async def get_entity(self, entity):
+        await self._request("get_entity")
+        if isinstance(entity, list):
+            return [self.user(user_id) for user_id in entity]
+        return self.user(entity)
+
+    # Downloads: photos and thumbnails are one request, documents one request per chunk
+    async def download_profile_photo(self, entity, file=None, **kwargs):
+        await self._request("download_profile_photo")
+        if entity % 4 == 0:
+            return None
+        file.write(b"\xff\xd8" + bytes(self.photo_size // 16))
+        return file
+
+    async def download_media(self, media, file=None, thumb=None, **kwargs):
+        size = thumb.size if thumb is not None else self.photo_size
+        await self._request("download_media")
+        file.write(bytes(size))
+        return file
+
+    async def iter_download(self, media, offset=0, request_size=512 * 1024, file_size=None, **kwargs):
+        size = file_size or media.document.size
+        while offset < size:
+            await self._request("iter_download")
+            chunk = min(request_size, size - offset)
+            offset += chunk
+            yield bytes(chunk)
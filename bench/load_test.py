@@ -0,0 +1,229 @@
+import argparse
+import asyncio
+import importlib
+import itertools
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+from bench.fake_telegram import FakeTelegramClient
+from client_pool import ClientPool
+
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_MEDIA_FILTERS = ("photo_video", "document", "music")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Load-test the web UI in-process against a fake Telegram client")
+    parser.add_argument("--tabs", default="messages,users,media", help="comma-separated tabs to drive")
+    parser.add_argument("--requests", type=int, default=300, help="requests per tab")
+    parser.add_argument("--warmup", type=int, default=20, help="requests per tab left out of the statistics")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=20, help="page size requested")
+    parser.add_argument("--deep-page-rate", type=float, default=0.3, help="share of requests for an older page")
+    parser.add_argument("--search-rate", type=float, default=0.1, help="share of messages/users requests with a query")
+    parser.add_argument("--chats", type=int, default=5)
+    parser.add_argument("--messages", type=int, default=5000, help="messages per chat")
+    parser.add_argument("--members", type=int, default=500, help="members per chat")
+    parser.add_argument("--media-ratio", type=float, default=0.3, help="share of messages carrying media")
+    parser.add_argument("--photo-size", type=int, default=128 * 1024, help="bytes per photo")
+    parser.add_argument("--document-size", type=int, default=2 * 1024 * 1024, help="bytes per document")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per Telegram request")
+    parser.add_argument("--jitter", type=float, default=0.5, help="latency varies by +/- this fraction")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="share of Telegram requests that flood wait")
+    parser.add_argument("--flood-seconds", type=int, default=1)
+    parser.add_argument("--accounts", type=int, default=1,
+                        help="fake accounts behind the app's client pool, each with its own flood waits")
+    parser.add_argument("--sync-index", action="store_true",
+                        help="index every chat before the run, so messages pages come from the local index")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="keep the app's log output")
+    return parser.parse_args(argv)
+
+
+def peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+# Import and configure app.py inside a scratch directory, so its caches, index and log stay out of the checkout,
+# and swap its Telegram client for the fake
+def load_app(fake: FakeTelegramClient, workdir: str, verbose: bool):
+    os.environ.setdefault("TG_API_ID", "1")
+    os.environ.setdefault("TG_API_HASH", "bench")
+    os.environ.setdefault("TG_PHONE", "+10000000000")
+    os.symlink(os.path.join(_REPO_ROOT, "templates"), os.path.join(workdir, "templates"))
+    os.chdir(workdir)
+    if _REPO_ROOT not in sys.path:
+        sys.path.insert(0, _REPO_ROOT)
+    app_module = importlib.import_module("app")
+    app_module.configure()
+    if not verbose:
+        logging.getLogger().setLevel(logging.CRITICAL)
+    app_module.client = fake
+    app_module._index_sync_pause = 0
+    app_module._startup_status = "ready"
+    return app_module
+
+
+# URL of one request, spread over chats, pages, media kinds and the occasional search
+def request_url(tab: str, fake: FakeTelegramClient, args, rng: random.Random) -> str:
+    chat_id = rng.choice(fake.chat_ids)
+    url = f"/?tab={tab}&chat_id={chat_id}&limit={args.limit}"
+    deep = rng.random() < args.deep_page_rate
+    if tab == "messages":
+        if deep:
+            url += f"&offset_id={rng.randint(args.limit + 1, args.messages)}"
+        if rng.random() < args.search_rate:
+            url += f"&query={rng.choice(('meeting', 'deploy', 'coffee', 'budget'))}"
+    elif tab == "users":
+        members = fake.member_ids(chat_id)
+        if deep:
+            url += f"&offset_id={rng.choice(members)}"
+        if rng.random() < args.search_rate:
+            url += f"&query={rng.choice(('user1', 'lunch', 'plan'))}"
+    elif tab == "media":
+        url += f"&media_filter={rng.choice(_MEDIA_FILTERS)}"
+        if deep:
+            url += f"&offset_id={rng.randint(args.limit + 1, args.messages)}"
+    return url
+
+
+async def drain_background(app_module):
+    while app_module._prefetch_tasks:
+        await asyncio.gather(*list(app_module._prefetch_tasks), return_exceptions=True)
+
+
+async def sync_index(app_module, fake: FakeTelegramClient):
+    app_module.start_index_sync()
+    while True:
+        states = [await asyncio.to_thread(app_module._message_index.get_state, chat_id) for chat_id in fake.chat_ids]
+        if all(state and state["backfill_done"] for state in states):
+            return
+        await asyncio.sleep(0.1)
+
+
+# Drive one tab with `concurrency` clients and collect latency, status and Telegram call counts
+async def run_tab(http, app_module, fake: FakeTelegramClient, tab: str, args) -> dict:
+    rng = random.Random(f"{args.seed}:{tab}")
+    for _ in range(args.warmup):
+        await http.get(request_url(tab, fake, args, rng))
+    await drain_background(app_module)
+    fake.calls.clear()
+
+    latencies = []
+    statuses = {}
+    counter = itertools.count()
+
+    async def client_loop():
+        while next(counter) < args.requests:
+            url = request_url(tab, fake, args, rng)
+            start = time.perf_counter()
+            response = await http.get(url)
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(client_loop() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started_at
+    await drain_background(app_module)  # Prefetches a page started count toward that tab
+    calls = dict(fake.calls)
+    telegram_calls = sum(count for method, count in calls.items() if method != "flood_wait")
+    return {
+        "tab": tab,
+        "requests": len(latencies),
+        "errors": sum(count for status, count in statuses.items() if status >= 400),
+        "statuses": statuses,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": max(latencies, default=0.0) * 1000,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "telegram_calls_per_request": telegram_calls / len(latencies) if latencies else 0.0,
+        "telegram_calls": calls,
+        "peak_rss_mb": peak_rss_bytes() / (1024 * 1024)
+    }
+
+
+# Run the benchmark in a scratch directory that is removed afterwards
+async def run(args) -> list[dict]:
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="tg-bench-") as workdir:
+        try:
+            return await run_in(args, workdir)
+        finally:
+            os.chdir(cwd)  # load_app() moved into the scratch directory
+
+
+async def run_in(args, workdir: str) -> list[dict]:
+    import httpx
+
+    fake = FakeTelegramClient(chats=args.chats, messages_per_chat=args.messages, members_per_chat=args.members,
+                              media_ratio=args.media_ratio, photo_size=args.photo_size,
+                              document_size=args.document_size, latency=args.latency, jitter=args.jitter,
+                              flood_rate=args.flood_rate, flood_seconds=args.flood_seconds, seed=args.seed)
+    app_module = load_app(fake, workdir, args.verbose)
+    if args.accounts > 1:
+        # Same chats on every account; calls are counted together
+        accounts = {"account0": fake}
+        for i in range(1, args.accounts):
+            accounts[f"account{i}"] = FakeTelegramClient(
+                chats=args.chats, messages_per_chat=args.messages, members_per_chat=args.members,
+                media_ratio=args.media_ratio, photo_size=args.photo_size, document_size=args.document_size,
+                latency=args.latency, jitter=args.jitter, flood_rate=args.flood_rate,
+                flood_seconds=args.flood_seconds, seed=args.seed)
+            accounts[f"account{i}"].calls = fake.calls
+            accounts[f"account{i}"]._rng.seed(f"{args.seed}:{i}")
+        app_module.client = ClientPool(accounts)
+    if args.sync_index:
+        await sync_index(app_module, fake)
+    transport = httpx.ASGITransport(app=app_module.app)
+    results = []
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        for tab in args.tabs.split(","):
+            results.append(await run_tab(http, app_module, fake, tab.strip(), args))
+    await app_module._download_scheduler.stop()
+    app_module._preview_renderer.shutdown()
+    app_module._media_cache.close()
+    app_module._avatar_cache.close()
+    return results
+
+
+def print_results(results: list[dict]):
+    print(f"{'tab':<10}{'requests':>9}{'errors':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'req/s':>9}"
+          f"{'tg/req':>8}{'peak RSS MB':>13}")
+    for r in results:
+        print(f"{r['tab']:<10}{r['requests']:>9}{r['errors']:>8}{r['p50_ms']:>10.1f}{r['p99_ms']:>10.1f}"
+              f"{r['max_ms']:>10.1f}{r['throughput_rps']:>9.1f}{r['telegram_calls_per_request']:>8.2f}"
+              f"{r['peak_rss_mb']:>13.1f}")
+    for r in results:
+        calls = ", ".join(f"{method}={count}" for method, count in sorted(r["telegram_calls"].items()))
+        print(f"{r['tab']} Telegram calls: {calls or 'none'}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.json:
+        args.json = os.path.abspath(args.json)  # load_app() changes directory
+    results = asyncio.run(run(args))
+    print_results(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import asyncio
+import io
+import json
+import os
+import shutil
+import time
+import zipfile
+
+# Export states; only "done" exports can be downloaded, anything but "done" can be resumed
+STATUS_RUNNING = "running"
+STATUS_WAITING = "waiting"  # Sitting out a flood wait
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+
+
+# Token bucket shared by every export, in Telegram requests per minute
+class RateBudget:
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self._tokens = per_minute
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, cost: float = 1):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.per_minute, self._tokens + (now - self._updated_at) * self.per_minute / 60.0)
+                self._updated_at = now
+                # A cost larger than the whole bucket only has to wait for a full bucket
+                if self._tokens >= min(cost, self.per_minute):
+                    self._tokens -= cost
+                    return
+                await asyncio.sleep((min(cost, self.per_minute) - self._tokens) * 60.0 / self.per_minute)
+
+
+def _write_json(path: str, data: dict):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+# One chat's export on disk: messages.jsonl (one message per line, oldest first), media/ and a
+# state.json checkpoint. A batch is checkpointed only after its lines are flushed to disk, together
+# with the file length at that point, so a resumed export first cuts off anything written after the
+# last checkpoint and then continues after the last exported message id.
+class ChatExport:
+    def __init__(self, directory: str, state: dict):
+        self.directory = directory
+        self.state = state
+
+    @property
+    def chat_id(self) -> int:
+        return self.state["chat_id"]
+
+    @property
+    def messages_path(self) -> str:
+        return os.path.join(self.directory, "messages.jsonl")
+
+    @property
+    def media_dir(self) -> str:
+        return os.path.join(self.directory, "media")
+
+    def progress(self) -> dict:
+        progress = dict(self.state)
+        total = progress.get("total_messages")
+        progress["percent"] = round(min(100.0, 100.0 * progress["messages"] / total), 1) if total else None
+        return progress
+
+    def save(self):
+        self.state["updated_at"] = time.time()
+        _write_json(os.path.join(self.directory, "state.json"), self.state)
+
+    # Drop lines written after the last checkpoint (an interrupted batch)
+    def truncate_to_checkpoint(self):
+        with open(self.messages_path, "ab") as f:
+            f.truncate(self.state["jsonl_bytes"])
+
+    def append_lines(self, lines: list[str]) -> int:
+        with open(self.messages_path, "ab") as f:
+            f.write("".join(line + "\n" for line in lines).encode())
+            f.flush()
+            os.fsync(f.fileno())
+            return f.tell()
+
+    # Put a cached media file into the export, hard-linked when the cache is on the same filesystem
+    def add_media_file(self, cached_path: str, name: str) -> int:
+        path = os.path.join(self.media_dir, name)
+        try:
+            os.link(cached_path, path)
+        except FileExistsError:
+            pass
+        except OSError:
+            shutil.copyfile(cached_path, path)
+        return os.path.getsize(path)
+
+    # (name in archive, path) of every file in the finished export
+    def archive_files(self) -> list[tuple[str, str]]:
+        files = [("messages.jsonl", self.messages_path)]
+        for entry in sorted(os.scandir(self.media_dir), key=lambda entry: entry.name):
+            files.append((f"media/{entry.name}", entry.path))
+        return files
+
+
+# All exports, one directory per chat under `directory`
+class ExportStore:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._exports = {}  # chat_id -> ChatExport
+
+    def load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        for entry in os.scandir(self.directory):
+            try:
+                with open(os.path.join(entry.path, "state.json"), "r") as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                continue
+            self._exports[state["chat_id"]] = ChatExport(entry.path, state)
+
+    def path(self, chat_id: int) -> str:
+        return os.path.join(self.directory, str(chat_id))
+
+    def get(self, chat_id: int) -> ChatExport | None:
+        return self._exports.get(chat_id)
+
+    def all(self) -> list[ChatExport]:
+        return list(self._exports.values())
+
+    # Start a chat's export from scratch, discarding any previous one
+    def create(self, chat_id: int, include_media: bool) -> ChatExport:
+        directory = self.path(chat_id)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(os.path.join(directory, "media"))
+        export = ChatExport(directory, {
+            "chat_id": chat_id,
+            "include_media": include_media,
+            "status": STATUS_RUNNING,
+            "last_id": 0,
+            "jsonl_bytes": 0,
+            "messages": 0,
+            "media_files": 0,
+            "media_bytes": 0,
+            "media_skipped": 0,
+            "total_messages": None,
+            "error": None,
+            "retry_at": None,
+            "started_at": time.time()
+        })
+        open(export.messages_path, "wb").close()
+        export.save()
+        self._exports[chat_id] = export
+        return export
+
+
+class _ZipStream(io.RawIOBase):
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+# ZIP archive of files generated while it is sent: nothing is built on disk first, and memory use
+# stays at one chunk. Iterate it in a worker thread (Starlette does this for sync generators).
+def iter_zip(files: list[tuple[str, str]], chunk_size: int = 512 * 1024):
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, "w") as archive:
+        for name, path in files:
+            info = zipfile.ZipInfo.from_file(path, name)
+            # Media is already compressed; the message log compresses well
+            info.compress_type = zipfile.ZIP_DEFLATED if name.endswith(".jsonl") else zipfile.ZIP_STORED
+            with open(path, "rb") as source, archive.open(info, "w") as target:
+                while chunk := source.read(chunk_size):
+                    target.write(chunk)
+                    if data := stream.take():
+                        yield data
+    if data := stream.take():
+        yield data
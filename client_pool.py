@@ -0,0 +1,298 @@
+import logging
+import math
+import time
+from contextlib import aclosing
+
+from telethon.errors import FloodWaitError, ChannelPrivateError, ChannelInvalidError, ChatForbiddenError, \
+    ChatAdminRequiredError, ChatIdInvalidError, PeerIdInvalidError, UserIdInvalidError, UserNotParticipantError, \
+    FileReferenceExpiredError
+
+from message_index import is_channel_id
+
+logger = logging.getLogger(__name__)
+
+# Errors meaning this account can't see the chat, user or file, where another account may
+_ACCESS_ERRORS = (ValueError, ChannelPrivateError, ChannelInvalidError, ChatForbiddenError, ChatAdminRequiredError,
+                  ChatIdInvalidError, PeerIdInvalidError, UserIdInvalidError, UserNotParticipantError,
+                  FileReferenceExpiredError)
+
+
+class Account:
+    def __init__(self, name: str, client):
+        self.name = name
+        self.client = client
+        self.active = True  # Connected and authorized
+        self.cooldown_until = 0.0
+        self.requests = 0
+        self.flood_waits = 0
+
+    @property
+    def cooldown(self) -> float:
+        return max(self.cooldown_until - time.monotonic(), 0.0)
+
+    @property
+    def ready(self) -> bool:
+        return self.active and self.cooldown == 0
+
+
+# Several authorized Telegram accounts behind the TelegramClient calls the app makes. Each read or
+# download goes to the next account in turn that can see the chat and is not sitting out a flood
+# wait; a FloodWaitError or an access error moves the call to the next account, resuming streams
+# where they stopped. Only when every candidate is cooling down does the caller get a FloodWaitError,
+# for the shortest remaining wait. The first account is the primary: it signs in, receives updates,
+# and alone serves basic groups, whose message ids differ from account to account.
+class ClientPool:
+    def __init__(self, clients: dict, on_flood=None):
+        self.accounts = [Account(name, client) for name, client in clients.items()]
+        self.primary = self.accounts[0].client
+        self.on_flood = on_flood  # Called with (method, seconds) when every account is cooling down
+        self.failovers = 0
+        self._chat_accounts = {}  # chat_id -> accounts that have the chat in their dialogs
+        self._turn = 0
+
+    # Lifecycle and auth: the primary account, plus whichever other sessions are already authorized
+    async def connect(self):
+        await self.primary.connect()
+        for account in self.accounts[1:]:
+            try:
+                await account.client.connect()
+                account.active = await account.client.is_user_authorized()
+            except Exception as e:
+                logger.warning("Error connecting session %s: %s", account.name, e)
+                account.active = False
+            if not account.active:
+                logger.warning("Session %s is not authorized, leaving it out of the pool", account.name)
+        logger.info("Client pool has %s active accounts", sum(account.active for account in self.accounts))
+
+    async def disconnect(self):
+        for account in self.accounts:
+            await account.client.disconnect()
+
+    def is_connected(self) -> bool:
+        return self.primary.is_connected()
+
+    def on(self, event):
+        return self.primary.on(event)
+
+    def add_event_handler(self, handler, event=None):
+        self.primary.add_event_handler(handler, event)
+
+    async def is_user_authorized(self) -> bool:
+        return await self.primary.is_user_authorized()
+
+    async def send_code_request(self, phone):
+        return await self.primary.send_code_request(phone)
+
+    async def sign_in(self, *args, **kwargs):
+        return await self.primary.sign_in(*args, **kwargs)
+
+    async def get_peer_id(self, peer) -> int:
+        return await self.primary.get_peer_id(peer)
+
+    # Accounts to try for a call, ready ones first, taking turns so load spreads over the pool
+    def _candidates(self, chat_id: int | None = None, preferred: str | None = None) -> list[Account]:
+        accounts = [account for account in self.accounts if account.active]
+        if isinstance(chat_id, int):
+            known = self._chat_accounts.get(chat_id)
+            if known:
+                accounts = [account for account in known if account.active]
+            if not is_channel_id(chat_id):
+                return accounts[:1]
+        if accounts:
+            self._turn += 1
+            start = self._turn % len(accounts)
+            accounts = accounts[start:] + accounts[:start]
+        accounts.sort(key=lambda account: (not account.ready, account.name != preferred))
+        return accounts
+
+    def _cool_down(self, account: Account, seconds: int):
+        account.flood_waits += 1
+        account.cooldown_until = max(account.cooldown_until, time.monotonic() + seconds)
+        logger.warning("Account %s hit a flood wait, cooling down for %s seconds", account.name, seconds)
+
+    # Error for a call no account could serve: a flood wait while any candidate is cooling down
+    def _unavailable(self, method: str, candidates: list[Account], error: Exception | None) -> Exception:
+        cooldowns = [account.cooldown for account in candidates if account.active and account.cooldown > 0]
+        if cooldowns:
+            seconds = math.ceil(min(cooldowns))
+            if self.on_flood is not None:
+                self.on_flood(method, seconds)
+            return FloodWaitError(request=None, capture=seconds)
+        return error or ValueError(f"No Telegram account can serve {method}")
+
+    async def _call(self, method: str, candidates: list[Account], call):
+        error = None
+        for account in candidates:
+            if not account.ready:
+                continue
+            if error is not None:
+                self.failovers += 1
+            account.requests += 1
+            try:
+                return await call(account)
+            except FloodWaitError as e:
+                self._cool_down(account, e.seconds)
+                error = e
+            except _ACCESS_ERRORS as e:
+                error = e
+        raise self._unavailable(method, candidates, error)
+
+    # Like _call for iterators: open_stream(account) starts (or, after items were seen, continues) the
+    # iteration, advance(item) records progress. Without advance, a stream that already produced
+    # items can't move to another account.
+    async def _stream(self, method: str, candidates: list[Account], open_stream, advance=None):
+        error = None
+        started = False
+        for account in candidates:
+            if not account.ready:
+                continue
+            if error is not None:
+                self.failovers += 1
+            account.requests += 1
+            try:
+                async with aclosing(open_stream(account)) as items:
+                    async for item in items:
+                        started = True
+                        if advance is not None:
+                            advance(item)
+                        yield item
+                return
+            except FloodWaitError as e:
+                self._cool_down(account, e.seconds)
+                error = e
+            except _ACCESS_ERRORS as e:
+                error = e
+            if started and advance is None:
+                raise error
+        raise self._unavailable(method, candidates, error)
+
+    # Mark a message's media with the account that fetched it, whose file reference downloads should use
+    @staticmethod
+    def _tag(msg, account: Account):
+        media = getattr(msg, "media", None)
+        if media is not None:
+            media._pool_account = account.name
+
+    # Dialogs of every account, each chat once; also records which accounts can see which chat
+    async def iter_dialogs(self, **kwargs):
+        seen = set()
+        chat_accounts = {}
+        for account in self.accounts:
+            if not account.active:
+                continue
+            try:
+                async for dialog in account.client.iter_dialogs(**kwargs):
+                    chat_accounts.setdefault(dialog.id, []).append(account)
+                    if dialog.id not in seen:
+                        seen.add(dialog.id)
+                        yield dialog
+            except FloodWaitError as e:
+                self._cool_down(account, e.seconds)
+                if account.client is self.primary:
+                    raise
+                # Keep what we knew about this account's chats until the next refresh
+                for chat_id, accounts in self._chat_accounts.items():
+                    if account in accounts:
+                        chat_accounts.setdefault(chat_id, []).append(account)
+        self._chat_accounts = chat_accounts
+
+    async def iter_messages(self, entity, limit=None, **kwargs):
+        state = {"limit": limit, "kwargs": kwargs}
+
+        def open_stream(account):
+            return self._tagged(account, account.client.iter_messages(entity, limit=state["limit"],
+                                                                      **state["kwargs"]))
+
+        # Continue after the last message seen, in whichever direction the iteration runs
+        def advance(msg):
+            state["kwargs"] = dict(state["kwargs"], **{"min_id" if kwargs.get("reverse") else "offset_id": msg.id})
+            if state["limit"] is not None:
+                state["limit"] -= 1
+
+        async for msg in self._stream("iter_messages", self._candidates(entity), open_stream, advance):
+            yield msg
+
+    async def _tagged(self, account: Account, messages):
+        async for msg in messages:
+            self._tag(msg, account)
+            yield msg
+
+    async def get_messages(self, entity, *args, **kwargs):
+        async def call(account):
+            result = await account.client.get_messages(entity, *args, **kwargs)
+            for msg in result if isinstance(result, list) else [result]:
+                self._tag(msg, account)
+            return result
+
+        return await self._call("get_messages", self._candidates(entity), call)
+
+    def iter_participants(self, entity, *args, **kwargs):
+        return self._stream("iter_participants", self._candidates(entity),
+                            lambda account: account.client.iter_participants(entity, *args, **kwargs))
+
+    async def get_participants(self, entity, *args, **kwargs):
+        return await self._call("get_participants", self._candidates(entity),
+                                lambda account: account.client.get_participants(entity, *args, **kwargs))
+
+    async def get_entity(self, entity):
+        return await self._call("get_entity", self._candidates(),
+                                lambda account: account.client.get_entity(entity))
+
+    # Downloads: prefer the account that fetched the message; a retry starts the file over
+    async def download_media(self, media, file=None, **kwargs):
+        async def call(account):
+            if hasattr(file, "truncate"):
+                file.seek(0)
+                file.truncate()
+            return await account.client.download_media(media, file=file, **kwargs)
+
+        return await self._call("download_media",
+                                self._candidates(preferred=getattr(media, "_pool_account", None)), call)
+
+    async def download_profile_photo(self, entity, file=None, **kwargs):
+        async def call(account):
+            if hasattr(file, "truncate"):
+                file.seek(0)
+                file.truncate()
+            return await account.client.download_profile_photo(entity, file=file, **kwargs)
+
+        return await self._call("download_profile_photo", self._candidates(), call)
+
+    async def iter_download(self, media, offset=0, request_size=512 * 1024, **kwargs):
+        state = {"offset": offset}
+
+        def advance(chunk):
+            state["offset"] += len(chunk)
+
+        # Telegram only serves parts at offsets aligned to the request size: (re)start at the part
+        # holding the next byte and drop what comes before it
+        async def open_stream(account):
+            aligned = state["offset"] - state["offset"] % request_size
+            skip = state["offset"] - aligned
+            async with aclosing(account.client.iter_download(media, offset=aligned, request_size=request_size,
+                                                             **kwargs)) as parts:
+                async for chunk in parts:
+                    if skip:
+                        dropped = min(skip, len(chunk))
+                        chunk, skip = chunk[dropped:], skip - dropped
+                        if not chunk:
+                            continue
+                    yield chunk
+
+        chunks = self._stream("iter_download", self._candidates(preferred=getattr(media, "_pool_account", None)),
+                              open_stream, advance)
+        async with aclosing(chunks):
+            async for chunk in chunks:
+                yield chunk
+
+
+# Log in an extra pool session interactively: python -m client_pool <session name>
+if __name__ == "__main__":
+    import os
+    import sys
+    from dotenv import load_dotenv
+    from telethon.sync import TelegramClient
+
+    load_dotenv()
+    with TelegramClient(sys.argv[1], int(os.getenv("TG_API_ID")), os.getenv("TG_API_HASH")) as session_client:
+        print(f"Session {sys.argv[1]} is authorized as {session_client.get_me().username}")
@@ -0,0 +1,127 @@
+import asyncio
+import itertools
+import logging
+import time
+from contextlib import asynccontextmanager
+
+from telethon.errors import FloodWaitError
+
+logger = logging.getLogger(__name__)
+
+# Lower runs first
+PRIORITY_THUMBNAIL = 0
+PRIORITY_FULL = 1
+PRIORITY_PREFETCH = 2
+
+
+# Shared download scheduler: a bounded pool of workers pulling jobs by priority, coalescing of
+# concurrent requests for the same key into one download, and one global flood-wait deadline that
+# every worker (and any caller streaming outside the pool) waits out before touching Telegram.
+# Callers that stream a download straight to a response take one of `streams` stream slots.
+class DownloadScheduler:
+    def __init__(self, workers: int = 4, streams: int = 4, max_flood_retries: int = 3):
+        self.workers = workers
+        self.streams = streams
+        self.max_flood_retries = max_flood_retries
+        self._stream_slots = asyncio.Semaphore(streams)
+        self._queue = None
+        self._tasks = []
+        self._inflight = {}  # key -> Future shared by every caller asking for that key
+        self._priorities = {}  # key -> best priority the key is queued at
+        self._running = set()  # Keys a worker is downloading
+        self._sequence = itertools.count()  # FIFO order within a priority
+        self._flood_until = 0.0
+        self.flood_waits = 0
+        self.flood_seconds = 0.0
+
+    @property
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+    @property
+    def queued(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    @property
+    def flood_remaining(self) -> float:
+        return max(self._flood_until - time.monotonic(), 0.0)
+
+    def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # Record a FloodWaitError seen anywhere, pushing back every download
+    def flood_wait(self, seconds: float):
+        self.flood_waits += 1
+        until = time.monotonic() + seconds
+        # Count only the time added to the shared deadline, so overlapping waits are not summed twice
+        self.flood_seconds += max(until - max(self._flood_until, time.monotonic()), 0.0)
+        if until > self._flood_until:
+            logger.warning("Flood wait: pausing downloads for %s seconds", seconds)
+            self._flood_until = until
+
+    async def wait_for_flood(self):
+        while (remaining := self.flood_remaining) > 0:
+            await asyncio.sleep(remaining)
+
+    # Hold a stream slot for a download streamed outside the pool, once any flood wait is over
+    @asynccontextmanager
+    async def stream_slot(self):
+        async with self._stream_slots:
+            await self.wait_for_flood()
+            yield
+
+    # Run download() through the pool, or join the download already queued or running for the same
+    # key. Joining a queued job at a better priority moves it up: it is queued again at that priority,
+    # and workers skip whichever entry of the job comes up second.
+    async def submit(self, key, download, priority: int = PRIORITY_FULL):
+        future = self._inflight.get(key)
+        if future is None:
+            self.start()
+            future = asyncio.get_running_loop().create_future()
+            self._inflight[key] = future
+            self._priorities[key] = priority
+            self._queue.put_nowait((priority, next(self._sequence), key, download, 0))
+        elif priority < self._priorities[key] and key not in self._running:
+            self._priorities[key] = priority
+            self._queue.put_nowait((priority, next(self._sequence), key, download, 0))
+        return await asyncio.shield(future)
+
+    async def _worker(self):
+        while True:
+            priority, sequence, key, download, flood_retries = await self._queue.get()
+            future = self._inflight.get(key)
+            if future is None or key in self._running:
+                self._queue.task_done()  # Another entry of a job that was moved up, already done or running
+                continue
+            self._running.add(key)
+            try:
+                await self.wait_for_flood()
+                future.set_result(await download())
+            except FloodWaitError as e:
+                self.flood_wait(e.seconds)
+                if flood_retries < self.max_flood_retries:
+                    # Keep the job's place in line; it runs again once the flood wait is over
+                    self._queue.put_nowait((priority, sequence, key, download, flood_retries + 1))
+                    continue
+                future.set_exception(e)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                self._running.discard(key)
+                self._queue.task_done()
+            del self._inflight[key]
+            del self._priorities[key]
+            if not future.cancelled():
+                future.exception()  # Mark an error as retrieved even if every caller has gone away
@@ -0,0 +1,74 @@
+import asyncio
+from collections import deque
+
+
+# Per-chat fan-out of live messages: a ring buffer of the newest messages seen since startup, and a
+# bounded queue per subscriber. Slow subscribers lose their oldest pending events instead of
+# holding up the Telegram update handler.
+class LiveFeed:
+    def __init__(self, buffer_size: int = 200, queue_size: int = 100):
+        self.buffer_size = buffer_size
+        self.queue_size = queue_size
+        self._buffers = {}  # chat_id -> deque of message dicts, oldest first
+        self._subscribers = {}  # chat_id -> set of asyncio.Queue
+
+    def subscriber_count(self, chat_id: int | None = None) -> int:
+        if chat_id is not None:
+            return len(self._subscribers.get(chat_id, ()))
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    def buffered_chats(self) -> list[int]:
+        return list(self._buffers)
+
+    def publish(self, chat_id: int, event: str, message: dict):
+        buffer = self._buffers.setdefault(chat_id, deque(maxlen=self.buffer_size))
+        if event == "message":
+            buffer.append(message)
+        elif event == "edit":
+            for i, buffered in enumerate(buffer):
+                if buffered["id"] == message["id"]:
+                    buffer[i] = message
+        for queue in self._subscribers.get(chat_id, ()):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait((event, message))
+
+    def remove(self, chat_id: int, message_ids: list[int]):
+        buffer = self._buffers.get(chat_id)
+        if not buffer:
+            return
+        removed = set(message_ids)
+        kept = [message for message in buffer if message["id"] not in removed]
+        if len(kept) != len(buffer):
+            self._buffers[chat_id] = deque(kept, maxlen=self.buffer_size)
+            for queue in self._subscribers.get(chat_id, ()):
+                if queue.full():
+                    queue.get_nowait()
+                queue.put_nowait(("delete", {"ids": sorted(removed)}))
+
+    # Forget buffered messages, e.g. after missing updates: latest() must not serve a buffer with gaps
+    def clear(self):
+        self._buffers.clear()
+
+    # Newest `limit` messages, newest first, or None if fewer than that arrived since startup
+    def latest(self, chat_id: int, limit: int) -> list[dict] | None:
+        buffer = self._buffers.get(chat_id)
+        if not buffer or len(buffer) < limit:
+            return None
+        return list(reversed(buffer))[:limit]
+
+    # Buffered messages newer than after_id, oldest first (for reconnecting subscribers)
+    def since(self, chat_id: int, after_id: int) -> list[dict]:
+        return [message for message in self._buffers.get(chat_id, ()) if message["id"] > after_id]
+
+    def subscribe(self, chat_id: int) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(chat_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, chat_id: int, queue: asyncio.Queue):
+        queues = self._subscribers.get(chat_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[chat_id]
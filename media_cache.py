@@ -0,0 +1,309 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_used_at ON entries (used_at);
+"""
+
+
+# Cache key for one size variant of a photo or document: Telegram's (id, access_hash) pair names the
+# file itself, so the same file forwarded to several chats is stored once
+def media_key(kind: str, file_id: int, access_hash: int, variant: str) -> str:
+    return hashlib.sha1(f"{kind}:{file_id}:{access_hash}:{variant}".encode()).hexdigest()
+
+
+def _write_file(path: str, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _write_flushed(f, data: bytes):
+    f.write(data)
+    f.flush()
+
+
+def _read_at(f, offset: int, size: int) -> bytes:
+    f.seek(offset)
+    return f.read(size)
+
+
+# A streamed write into the cache that readers can follow while it grows. The writer calls write()
+# per chunk and then commit() or discard(); follow() reads a byte range, waiting for bytes not yet
+# written and finishing from the committed file (still open, so renaming it does not matter).
+class CacheFill:
+    def __init__(self, cache: "MediaCache", key: str):
+        self.cache = cache
+        self.key = key
+        self.path = cache.reserve(key)
+        self.written = 0
+        self.done = False
+        self.error = None
+        self._file = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait(self):
+        await self._changed.wait()
+
+    def _finish(self, error: Exception | None):
+        if self.cache._fills.get(self.key) is self:
+            del self.cache._fills[self.key]
+        self.done = True
+        self.error = error
+        self._notify()
+
+    async def write(self, data: bytes):
+        if self._file is None:
+            self._file = await asyncio.to_thread(open, self.path, "wb")
+        await asyncio.to_thread(_write_flushed, self._file, data)
+        self.written += len(data)
+        self._notify()
+
+    async def _close(self):
+        if self._file is not None:
+            await asyncio.to_thread(self._file.close)
+
+    async def commit(self) -> str:
+        try:
+            await self._close()
+            if self._file is None:
+                await asyncio.to_thread(_write_file, self.path, b"")
+            self.path = await self.cache.commit(self.key, self.path, self.written)
+        except BaseException as e:
+            await self.discard(e)
+            raise
+        self._finish(None)
+        return self.path
+
+    async def discard(self, error: BaseException | None = None):
+        await self._close()
+        await self.cache.discard(self.path)
+        self._finish(error or RuntimeError("Cache fill discarded"))
+
+    # Bytes start..end (inclusive) as they are written; raises the writer's error if it gives up
+    async def follow(self, start: int, end: int, chunk_size: int):
+        f = None
+        position = start
+        try:
+            while position <= end:
+                if self.written > position:
+                    if f is None:
+                        f = await asyncio.to_thread(open, self.path, "rb")
+                    size = min(chunk_size, self.written - position, end - position + 1)
+                    chunk = await asyncio.to_thread(_read_at, f, position, size)
+                    if not chunk:
+                        break
+                    position += len(chunk)
+                    yield chunk
+                elif self.done:
+                    if self.error is not None:
+                        raise self.error
+                    break
+                else:
+                    await self.wait()
+        finally:
+            if f is not None:
+                await asyncio.to_thread(f.close)
+
+
+# Content-addressed media cache: one file per key, a total-size budget with LRU eviction, and an
+# SQLite index (index.db in the cache directory) of sizes and last use, so eviction never needs a
+# directory scan. Writes go to a temp file that is renamed into place, so readers never see partial
+# files. Every process using the directory shares the index, and with it the LRU order and budget.
+class MediaCache:
+    def __init__(self, directory: str, budget_bytes: int):
+        self.directory = directory
+        self.budget_bytes = budget_bytes
+        self._index_file = os.path.join(directory, "index.db")
+        self._db = None
+        self._opening = None
+        self._lock = threading.Lock()
+        self._fills = {}  # key -> CacheFill in progress
+        self._fill_begun = asyncio.Event()
+        self._total_bytes = 0  # As of the last write; for metrics and logging
+        self._count = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.bin")
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def __len__(self):
+        return self._count
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        db = sqlite3.connect(self._index_file, timeout=30, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.executescript(_SCHEMA)
+        with self._lock, db:
+            if db.execute("SELECT 1 FROM entries LIMIT 1").fetchone() is None:
+                rows = self._scan_entries()
+                db.executemany("INSERT OR IGNORE INTO entries (key, size, used_at) VALUES (?, ?, ?)", rows)
+                if rows:
+                    logger.info("Indexed %s existing files in the media cache", len(rows))
+        self._db = db
+        self._refresh_totals()
+
+    # First start on an existing directory: take the old JSON index's LRU order, or file mtimes
+    def _scan_entries(self) -> list[tuple]:
+        json_index = os.path.join(self.directory, "index.json")
+        try:
+            with open(json_index, "r") as f:
+                keys = [key for key, _ in json.load(f)]
+            os.remove(json_index)
+        except (OSError, ValueError, TypeError):
+            keys = []
+        order = {key: i for i, key in enumerate(keys)}
+        rows = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".bin"):
+                stat = entry.stat()
+                key = entry.name[:-len(".bin")]
+                rows.append((key, stat.st_size, order.get(key, -1) if keys else stat.st_mtime))
+        return rows
+
+    def _refresh_totals(self):
+        with self._lock:
+            self._count, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        self._total_bytes = total
+
+    # Open the index once, however many callers arrive before it is ready
+    async def _ensure_open(self):
+        if self._db is None:
+            if self._opening is None:
+                self._opening = asyncio.ensure_future(asyncio.to_thread(self._open))
+            try:
+                await asyncio.shield(self._opening)
+            except Exception:
+                self._opening = None
+                raise
+
+    async def load(self):
+        await self._ensure_open()
+        logger.info("Media cache holds %s files, %s bytes", self._count, self._total_bytes)
+        await self.evict()
+
+    def close(self):
+        if self._db is not None:
+            with self._lock:
+                self._db.close()
+            self._db = None
+            self._opening = None
+
+    def _lookup(self, key: str) -> str | None:
+        path = self.path(key)
+        with self._lock, self._db:
+            if self._db.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone() is None:
+                return None
+            if not os.path.exists(path):
+                self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            self._db.execute("UPDATE entries SET used_at = ? WHERE key = ?", (time.time(), key))
+        return path
+
+    # Path of a cached file, marking it recently used, or None on a miss
+    async def get(self, key: str) -> str | None:
+        await self._ensure_open()
+        path = await asyncio.to_thread(self._lookup, key)
+        if path is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return path
+
+    async def put(self, key: str, data: bytes) -> str:
+        tmp_path = self.reserve(key)
+        await asyncio.to_thread(_write_file, tmp_path, data)
+        return await self.commit(key, tmp_path, len(data))
+
+    # Temp file for a streamed write; finish with commit() or discard()
+    def reserve(self, key: str) -> str:
+        return f"{self.path(key)}.{os.urandom(4).hex()}.part"
+
+    # Streamed write that other readers can follow; see CacheFill
+    def begin_fill(self, key: str) -> CacheFill:
+        fill = CacheFill(self, key)
+        self._fills[key] = fill
+        self._fill_begun.set()
+        self._fill_begun = asyncio.Event()
+        return fill
+
+    # The fill in progress for a key, if any
+    def filling(self, key: str) -> CacheFill | None:
+        return self._fills.get(key)
+
+    # Wait until the next fill begins, for any key
+    async def wait_for_fill(self):
+        await self._fill_begun.wait()
+
+    def _store(self, key: str, tmp_path: str, size: int) -> str:
+        path = self.path(key)
+        os.replace(tmp_path, path)
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO entries (key, size, used_at) VALUES (?, ?, ?)",
+                             (key, size, time.time()))
+        return path
+
+    async def commit(self, key: str, tmp_path: str, size: int) -> str:
+        await self._ensure_open()
+        path = await asyncio.to_thread(self._store, key, tmp_path, size)
+        await self.evict()
+        return path
+
+    async def discard(self, tmp_path: str):
+        await asyncio.to_thread(_remove_file, tmp_path)
+
+    # Drop least recently used entries past the budget; returns their keys
+    def _evict_entries(self) -> list[str]:
+        with self._lock, self._db:
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total <= self.budget_bytes:
+                return []
+            evicted = []
+            for key, size in self._db.execute("SELECT key, size FROM entries ORDER BY used_at"):
+                if total <= self.budget_bytes:
+                    break
+                evicted.append(key)
+                total -= size
+            self._db.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key in evicted])
+        for key in evicted:
+            _remove_file(self.path(key))
+        return evicted
+
+    async def evict(self):
+        await self._ensure_open()
+        evicted = await asyncio.to_thread(self._evict_entries)
+        await asyncio.to_thread(self._refresh_totals)
+        if evicted:
+            self.evictions += len(evicted)
+            logger.info("Evicted %s files from the media cache", len(evicted))
@@ -0,0 +1,142 @@
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+# Channels and supergroups have marked ids below this; basic groups share one account-wide id space
+_CHANNEL_ID_BOUND = -1000000000000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    rowid INTEGER PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    date INTEGER NOT NULL,
+    sender_id INTEGER,
+    text TEXT NOT NULL DEFAULT '',
+    media_type TEXT,
+    UNIQUE (chat_id, id)
+);
+CREATE INDEX IF NOT EXISTS messages_chat_date ON messages (chat_id, date);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(text, content='messages', content_rowid='rowid');
+CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, text) VALUES (new.rowid, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_au AFTER UPDATE OF text ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+    INSERT INTO messages_fts (rowid, text) VALUES (new.rowid, new.text);
+END;
+CREATE TABLE IF NOT EXISTS sync_state (
+    chat_id INTEGER PRIMARY KEY,
+    newest_id INTEGER NOT NULL,
+    oldest_id INTEGER NOT NULL,
+    backfill_done INTEGER NOT NULL DEFAULT 0,
+    synced_at REAL NOT NULL
+);
+"""
+
+
+def is_channel_id(chat_id: int) -> bool:
+    return chat_id < _CHANNEL_ID_BOUND
+
+
+# Turn free text into an FTS5 query: every word must match, as a prefix
+def fts_query(query: str) -> str:
+    return " ".join('"' + word.replace('"', '""') + '"*' for word in query.split())
+
+
+# Local SQLite/FTS5 store of chat messages with a per-chat sync watermark.
+# The index for a chat always covers one contiguous id range, [oldest_id, newest_id]: the sync
+# worker grows it downwards (backfill) and upwards (catch-up), and live messages extend it.
+# Methods are blocking; call them through asyncio.to_thread from async code.
+class MessageIndex:
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    # Insert or update messages given as dicts with id, date, sender_id, text and media_type
+    def add_messages(self, chat_id: int, messages: list[dict]):
+        if not messages:
+            return
+        rows = [(chat_id, m["id"], int(m["date"].timestamp()), m["sender_id"], m["text"] or "", m["media_type"])
+                for m in messages]
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT INTO messages (chat_id, id, date, sender_id, text, media_type) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (chat_id, id) DO UPDATE SET text = excluded.text, media_type = excluded.media_type",
+                rows)
+
+    # Delete messages; without a chat id, only basic groups (which share one id space) are matched
+    def delete_messages(self, chat_id: int | None, message_ids: list[int]):
+        if not message_ids:
+            return
+        marks = ",".join("?" * len(message_ids))
+        with self._lock, self._db:
+            if chat_id is None:
+                self._db.execute(f"DELETE FROM messages WHERE chat_id > ? AND id IN ({marks})",
+                                 (_CHANNEL_ID_BOUND, *message_ids))
+            else:
+                self._db.execute(f"DELETE FROM messages WHERE chat_id = ? AND id IN ({marks})",
+                                 (chat_id, *message_ids))
+
+    def get_state(self, chat_id: int) -> dict | None:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM sync_state WHERE chat_id = ?", (chat_id,)).fetchone()
+        return dict(row) if row else None
+
+    # Widen the chat's covered range and bump its freshness watermark
+    def update_state(self, chat_id: int, newest_id: int | None = None, oldest_id: int | None = None,
+                     backfill_done: bool | None = None):
+        with self._lock, self._db:
+            row = self._db.execute("SELECT * FROM sync_state WHERE chat_id = ?", (chat_id,)).fetchone()
+            if row is None:
+                if newest_id is None or oldest_id is None:
+                    return
+                self._db.execute("INSERT INTO sync_state VALUES (?, ?, ?, ?, ?)",
+                                 (chat_id, newest_id, oldest_id, int(bool(backfill_done)), time.time()))
+                return
+            self._db.execute(
+                "UPDATE sync_state SET newest_id = ?, oldest_id = ?, backfill_done = ?, synced_at = ? "
+                "WHERE chat_id = ?",
+                (max(row["newest_id"], newest_id or 0),
+                 min(row["oldest_id"], oldest_id) if oldest_id is not None else row["oldest_id"],
+                 int(backfill_done) if backfill_done is not None else row["backfill_done"],
+                 time.time(), chat_id))
+
+    # Newest-first messages of a chat below offset_id, optionally matching text and a date window
+    def search(self, chat_id: int, limit: int, offset_id: int = 0, query: str | None = None,
+               start: datetime | None = None, end: datetime | None = None) -> list[dict]:
+        sql = "SELECT m.id, m.date, m.sender_id, m.text, m.media_type FROM messages m"
+        clauses = ["m.chat_id = ?"]
+        params = [chat_id]
+        if query and query.split():
+            sql += " JOIN messages_fts f ON f.rowid = m.rowid"
+            clauses.append("messages_fts MATCH ?")
+            params.append(fts_query(query))
+        if offset_id:
+            clauses.append("m.id < ?")
+            params.append(offset_id)
+        if start:
+            clauses.append("m.date >= ?")
+            params.append(int(start.timestamp()))
+        if end:
+            clauses.append("m.date < ?")
+            params.append(int(end.timestamp()))
+        sql += f" WHERE {' AND '.join(clauses)} ORDER BY m.id DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        return [{"id": row["id"], "date": datetime.fromtimestamp(row["date"], tz=timezone.utc),
+                 "sender_id": row["sender_id"], "text": row["text"], "media_type": row["media_type"]}
+                for row in rows]
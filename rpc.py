@@ -0,0 +1,286 @@
+import asyncio
+import itertools
+import logging
+import os
+import pickle
+import struct
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct("!I")
+_STREAM_BATCH = 100  # Most stream items per frame
+_STREAM_WINDOW = 4  # Frames a stream may send ahead of what the caller has consumed
+
+
+# Error raised on the other side that could not be sent over as it is
+class RemoteError(Exception):
+    pass
+
+
+def _frame(message) -> bytes:
+    data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    return _HEADER.pack(len(data)) + data
+
+
+async def _read_frame(reader: asyncio.StreamReader):
+    size, = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    return pickle.loads(await reader.readexactly(size))
+
+
+def _portable_error(error: Exception) -> Exception:
+    try:
+        pickle.loads(pickle.dumps(error))  # Some exceptions pickle but can't be rebuilt
+        return error
+    except Exception:
+        return RemoteError(f"{type(error).__name__}: {error}")
+
+
+# Local RPC over a Unix socket, between processes of one deployment (so pickle is fine).
+# Registered coroutine functions answer once; async generator functions stream their items in
+# batches, with a small window of unacknowledged frames so a slow caller holds back the producer.
+# broadcast() pushes an event to every connected client.
+class RpcServer:
+    def __init__(self, path: str):
+        self.path = path
+        self._methods = {}
+        self._server = None
+        self._writers = set()
+
+    def register(self, name: str, func):
+        self._methods[name] = func
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)  # Left behind by a previous run
+        self._server = await asyncio.start_unix_server(self._serve, path=self.path)
+        logger.info("RPC server listening on %s", self.path)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    @property
+    def client_count(self) -> int:
+        return len(self._writers)
+
+    def broadcast(self, event):
+        frame = _frame((None, "event", event))
+        for writer in list(self._writers):
+            writer.write(frame)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        tasks = {}  # call_id -> task
+        windows = {}  # call_id -> Semaphore of a streaming call
+        self._writers.add(writer)
+        try:
+            while True:
+                call_id, kind, method, args, kwargs = await _read_frame(reader)
+                if kind == "cancel":
+                    task = tasks.get(call_id)
+                    if task is not None:
+                        task.cancel()
+                    continue
+                if kind == "ack":
+                    if call_id in windows:
+                        windows[call_id].release()
+                    continue
+                if kind == "stream":
+                    windows[call_id] = asyncio.Semaphore(_STREAM_WINDOW)
+                task = asyncio.create_task(self._run(writer, call_id, method, args, kwargs, windows.get(call_id)))
+                tasks[call_id] = task
+                task.add_done_callback(lambda t, c=call_id: (tasks.pop(c, None), windows.pop(c, None)))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            for task in list(tasks.values()):
+                task.cancel()
+            writer.close()
+
+    async def _run(self, writer, call_id, method: str, args, kwargs, window):
+        try:
+            func = self._methods.get(method)
+            if func is None:
+                raise RemoteError(f"Unknown method {method}")
+            if window is not None:
+                await self._stream(writer, call_id, func(*args, **kwargs), window)
+            else:
+                writer.write(_frame((call_id, "result", await func(*args, **kwargs))))
+            await writer.drain()
+        except asyncio.CancelledError:
+            raise
+        except ConnectionError:
+            pass
+        except Exception as e:
+            writer.write(_frame((call_id, "error", _portable_error(e))))
+
+    # Send what the generator has ready as one frame, so a page of messages travels together while
+    # download chunks go out as they arrive
+    async def _stream(self, writer, call_id, items, window: asyncio.Semaphore):
+        queue = asyncio.Queue(maxsize=_STREAM_BATCH)
+
+        async def produce():
+            try:
+                async for item in items:
+                    await queue.put(("item", item))
+                await queue.put(("end", None))
+            except Exception as e:
+                await queue.put(("error", e))
+
+        producer = asyncio.create_task(produce())
+        try:
+            while True:
+                batch = []
+                kind, value = await queue.get()
+                while kind == "item":
+                    batch.append(value)
+                    if queue.empty() or len(batch) >= _STREAM_BATCH:
+                        break
+                    kind, value = queue.get_nowait()
+                if batch:
+                    await window.acquire()
+                    writer.write(_frame((call_id, "items", batch)))
+                    await writer.drain()
+                if kind == "end":
+                    writer.write(_frame((call_id, "end", None)))
+                    return
+                if kind == "error":
+                    raise value
+        finally:
+            producer.cancel()
+
+
+class RpcClient:
+    def __init__(self, path: str, on_event=None, on_connect=None, connect_timeout: float = 5.0):
+        self.path = path
+        self.on_event = on_event  # Called with each broadcast event
+        self.on_connect = on_connect  # Awaited after every (re)connect
+        self.connect_timeout = connect_timeout
+        self._writer = None
+        self._pending = {}  # call_id -> Future (calls) or Queue (streams)
+        self._ids = itertools.count(1)
+        self._connected = asyncio.Event()
+        self._task = None
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    # Keep a connection open in the background, reconnecting with backoff
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        delay = 0.5
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except OSError as e:
+                logger.debug("RPC server %s unavailable: %s", self.path, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 10.0)
+                continue
+            delay = 0.5
+            self._writer = writer
+            self._connected.set()
+            logger.info("Connected to RPC server %s", self.path)
+            try:
+                if self.on_connect is not None:
+                    asyncio.create_task(self.on_connect())
+                await self._read_loop(reader)
+            finally:
+                self._connected.clear()
+                self._writer = None
+                writer.close()
+                for target in list(self._pending.values()):
+                    if isinstance(target, asyncio.Queue):
+                        target.put_nowait(("closed", None))
+                    elif not target.done():
+                        target.set_exception(ConnectionError("Connection to the RPC server was lost"))
+            logger.warning("Lost connection to RPC server %s", self.path)
+
+    async def _read_loop(self, reader: asyncio.StreamReader):
+        try:
+            while True:
+                call_id, kind, value = await _read_frame(reader)
+                if call_id is None:
+                    if self.on_event is not None:
+                        try:
+                            self.on_event(value)
+                        except Exception as e:
+                            logger.error("Error handling RPC event %s: %s", value, e)
+                    continue
+                target = self._pending.get(call_id)
+                if isinstance(target, asyncio.Queue):
+                    target.put_nowait((kind, value))
+                elif target is not None and not target.done():
+                    if kind == "error":
+                        target.set_exception(value)
+                    else:
+                        target.set_result(value)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+    async def _send(self, message):
+        if not self._connected.is_set():
+            try:
+                await asyncio.wait_for(self._connected.wait(), self.connect_timeout)
+            except asyncio.TimeoutError:
+                raise ConnectionError(f"RPC server {self.path} is not available")
+        self._writer.write(_frame(message))
+        await self._writer.drain()
+
+    def _send_nowait(self, message):
+        if self._writer is not None:
+            self._writer.write(_frame(message))
+
+    async def call(self, method: str, *args, **kwargs):
+        call_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[call_id] = future
+        try:
+            await self._send((call_id, "call", method, args, kwargs))
+            return await future
+        except asyncio.CancelledError:
+            self._send_nowait((call_id, "cancel", None, None, None))
+            raise
+        finally:
+            self._pending.pop(call_id, None)
+
+    async def stream(self, method: str, *args, **kwargs):
+        call_id = next(self._ids)
+        queue = asyncio.Queue()
+        self._pending[call_id] = queue
+        finished = False
+        try:
+            await self._send((call_id, "stream", method, args, kwargs))
+            while True:
+                kind, value = await queue.get()
+                if kind == "items":
+                    self._send_nowait((call_id, "ack", None, None, None))
+                    for item in value:
+                        yield item
+                elif kind == "end":
+                    finished = True
+                    return
+                elif kind == "error":
+                    finished = True
+                    raise value
+                else:
+                    finished = True
+                    raise ConnectionError("Connection to the RPC server was lost")
+        finally:
+            self._pending.pop(call_id, None)
+            if not finished:
+                self._send_nowait((call_id, "cancel", None, None, None))
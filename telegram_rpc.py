@@ -0,0 +1,141 @@
+from io import BytesIO
+from types import SimpleNamespace
+
+from telethon.helpers import TotalList
+
+from rpc import RpcClient, RpcServer
+
+
+# Plain copy of a Telethon message with the attributes the app reads. Telethon's Message holds a
+# reference to its client and can't cross a process boundary; the raw TL objects it carries can.
+def detach_message(msg):
+    if msg is None:
+        return None
+    return SimpleNamespace(id=msg.id, chat_id=msg.chat_id, date=msg.date, edit_date=msg.edit_date, text=msg.text,
+                           raw_text=msg.raw_text, media=msg.media, sender_id=msg.sender_id, sender=msg.sender,
+                           input_sender=msg.input_sender, out=msg.out, action=msg.action,
+                           reply_to_msg_id=msg.reply_to_msg_id)
+
+
+# Owner side: serves the process's TelegramClient to API workers under the method names the app calls
+class TelegramService:
+    def __init__(self, client, server: RpcServer):
+        self.client = client
+        for name in ("iter_dialogs", "iter_messages", "iter_participants", "iter_download", "get_messages",
+                     "get_participants", "get_entity", "get_peer_id", "download_media", "download_profile_photo",
+                     "is_user_authorized", "send_code_request"):
+            server.register(name, getattr(self, name))
+
+    async def iter_dialogs(self, **kwargs):
+        async for dialog in self.client.iter_dialogs(**kwargs):
+            yield SimpleNamespace(entity=dialog.entity, name=dialog.name, id=dialog.id)
+
+    async def iter_messages(self, *args, **kwargs):
+        async for msg in self.client.iter_messages(*args, **kwargs):
+            yield detach_message(msg)
+
+    async def iter_participants(self, *args, **kwargs):
+        async for user in self.client.iter_participants(*args, **kwargs):
+            yield user
+
+    async def iter_download(self, *args, **kwargs):
+        async for chunk in self.client.iter_download(*args, **kwargs):
+            yield bytes(chunk)
+
+    async def get_messages(self, *args, **kwargs):
+        result = await self.client.get_messages(*args, **kwargs)
+        if isinstance(result, list):
+            messages = TotalList(detach_message(msg) for msg in result)
+            messages.total = getattr(result, "total", len(result))
+            return messages
+        return detach_message(result)
+
+    async def get_participants(self, *args, **kwargs):
+        return await self.client.get_participants(*args, **kwargs)
+
+    async def get_entity(self, entity):
+        return await self.client.get_entity(entity)
+
+    async def get_peer_id(self, peer) -> int:
+        return await self.client.get_peer_id(peer)
+
+    async def download_media(self, media, thumb=None) -> bytes | None:
+        result = await self.client.download_media(media, file=BytesIO(), thumb=thumb)
+        return result.getvalue() if result is not None else None
+
+    async def download_profile_photo(self, entity, **kwargs) -> bytes | None:
+        result = await self.client.download_profile_photo(entity, file=BytesIO(), **kwargs)
+        return result.getvalue() if result is not None else None
+
+    async def is_user_authorized(self) -> bool:
+        return await self.client.is_user_authorized()
+
+    async def send_code_request(self, phone):
+        await self.client.send_code_request(phone)
+
+
+# Worker side: the subset of TelegramClient the app uses, forwarded to the owner process. Updates
+# are handled by the owner, which passes on what workers need as RPC events.
+class RemoteTelegramClient:
+    def __init__(self, rpc: RpcClient):
+        self.rpc = rpc
+
+    async def connect(self):
+        self.rpc.start()
+
+    async def disconnect(self):
+        await self.rpc.stop()
+
+    def is_connected(self) -> bool:
+        return self.rpc.connected
+
+    def on(self, event):
+        return lambda handler: handler
+
+    async def is_user_authorized(self) -> bool:
+        return await self.rpc.call("is_user_authorized")
+
+    async def send_code_request(self, phone):
+        await self.rpc.call("send_code_request", phone)
+
+    async def sign_in(self, phone=None, code=None, **kwargs):
+        await self.rpc.call("sign_in", code)
+
+    def iter_dialogs(self, **kwargs):
+        return self.rpc.stream("iter_dialogs", **kwargs)
+
+    def iter_messages(self, *args, **kwargs):
+        return self.rpc.stream("iter_messages", *args, **kwargs)
+
+    def iter_participants(self, *args, **kwargs):
+        return self.rpc.stream("iter_participants", *args, **kwargs)
+
+    def iter_download(self, *args, **kwargs):
+        return self.rpc.stream("iter_download", *args, **kwargs)
+
+    async def get_messages(self, *args, **kwargs):
+        return await self.rpc.call("get_messages", *args, **kwargs)
+
+    async def get_participants(self, *args, **kwargs):
+        return await self.rpc.call("get_participants", *args, **kwargs)
+
+    async def get_entity(self, entity):
+        return await self.rpc.call("get_entity", entity)
+
+    async def get_peer_id(self, peer) -> int:
+        return await self.rpc.call("get_peer_id", peer)
+
+    # Downloads arrive whole and are written to `file` like Telethon does
+    async def download_media(self, media, file=None, thumb=None, **kwargs):
+        data = await self.rpc.call("download_media", media, thumb=thumb)
+        if data is None or file is None or file is bytes:
+            return data
+        file.write(data)
+        return file
+
+    async def download_profile_photo(self, entity, file=None, **kwargs):
+        data = await self.rpc.call("download_profile_photo", entity, **kwargs)
+        if data is None or file is None or file is bytes:
+            return data
+        file.write(data)
+        return file
@@ -0,0 +1,74 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # Pillow is optional: without it the grid shows Telegram's own thumbnails
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_MIME_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg"}
+
+
+# Runs in a worker process: decode an image file, shrink it to fit max_side x max_side and encode
+# it as WebP or JPEG
+def make_preview(source_path: str, max_side: int, fmt: str, quality: int) -> bytes:
+    with Image.open(source_path) as image:
+        image.draft("RGB", (max_side, max_side))  # Let the JPEG decoder skip detail we would discard
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        output = BytesIO()
+        image.save(output, "WEBP" if fmt == "webp" else "JPEG", quality=quality, optimize=fmt == "jpeg")
+        return output.getvalue()
+
+
+# Preview renderer: CPU-bound decode/resize/encode in a process pool so it never blocks the event
+# loop, with concurrent requests for the same preview sharing one render
+class PreviewRenderer:
+    def __init__(self, workers: int = 2, max_side: int = 320, quality: int = 80):
+        self.workers = workers
+        self.max_side = max_side
+        self.quality = quality
+        self._executor = None
+        self._inflight = {}  # key -> Future
+        self.formats = ()
+        if Image is not None:
+            self.formats = ("webp", "jpeg") if features.check("webp") else ("jpeg",)
+
+    @property
+    def available(self) -> bool:
+        return bool(self.formats)
+
+    # Best format the client accepts, from its Accept header
+    def pick_format(self, accept: str | None) -> str:
+        if "webp" in self.formats and accept and "image/webp" in accept:
+            return "webp"
+        return "jpeg"
+
+    async def render(self, key: str, source_path: str, fmt: str) -> bytes:
+        future = self._inflight.get(key)
+        if future is None:
+            if self._executor is None:
+                # Spawned, not forked: by now this process runs threads (logging, to_thread, SQLite)
+                # whose locks a forked child could inherit held. Workers only need this module.
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context("spawn"))
+            future = asyncio.ensure_future(asyncio.get_running_loop().run_in_executor(
+                self._executor, make_preview, source_path, self.max_side, fmt, self.quality))
+            self._inflight[key] = future
+            future.add_done_callback(lambda f: self._finish(key, f))
+        return await asyncio.shield(future)
+
+    def _finish(self, key: str, future: asyncio.Future):
+        self._inflight.pop(key, None)
+        if not future.cancelled():
+            future.exception()  # Mark an error as retrieved even if every caller has gone away
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None